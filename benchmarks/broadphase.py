@@ -0,0 +1,57 @@
+'''Compare the bounding box tree with the spatial hash on large towers.
+
+Each level is a wall of wooden squares, COLUMNS wide and rows high, hit by
+a bird. The same level runs with the "tree" and "hash" broadphase override
+and with no override, which prints what get_broadphase chooses.
+
+Run from the project root: python -m benchmarks.broadphase
+'''
+
+import time
+from source import simulation
+from source import constants as c
+
+ROWS = [10, 20, 30, 50, 60]
+COLUMNS = 40
+FRAMES = 300
+SHOT = (100, -0.2)
+
+def get_tower(rows):
+    blocks = []
+    for i in range(COLUMNS):
+        for j in range(rows):
+            blocks.append({'x': 300 + i * 40, 'y': c.GROUND_HEIGHT - j * 38,
+                           c.MATERIAL: c.WOOD, c.SHAPE: c.BEAM, c.TYPE: c.BEAM_TYPE_6})
+    return blocks
+
+def run(rows, broadphase):
+    sim = simulation.Simulation(1)
+    sim.map_data[c.PIGS] = []
+    sim.map_data[c.BLOCKS] = get_tower(rows)
+    if broadphase is None:
+        sim.map_data.pop(c.BROADPHASE, None)
+    else:
+        sim.map_data[c.BROADPHASE] = broadphase
+    sim.reset()
+    chosen = sim.physics.broadphase
+    start = time.perf_counter()
+    sim.shoot(*SHOT, max_frames=FRAMES)
+    for i in range(FRAMES - sim.frame):
+        sim.step()
+    return (time.perf_counter() - start) / FRAMES * 1000, chosen
+
+def main():
+    print('shapes   tree ms   hash ms   auto ms  auto')
+    for rows in ROWS:
+        tree_time, chosen = run(rows, c.BROADPHASE_TREE)
+        hash_time, chosen = run(rows, c.BROADPHASE_HASH)
+        auto_time, chosen = run(rows, None)
+        if chosen is None:
+            name = c.BROADPHASE_TREE
+        else:
+            name = 'hash dim %.0f count %d' % chosen
+        print('%6d  %8.3f  %8.3f  %8.3f  %s' % (rows * COLUMNS, tree_time,
+              hash_time, auto_time, name))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''Count the contacts per frame with and without the collision filters.
+
+The scenes are the shots with the most bodies in flight: black birds that
+explode, white birds that drop eggs and blue birds that split in three.
+Without the filters every shape gets the default ShapeFilter, so the pairs
+between birds and eggs are collided again like before.
+
+Run from the project root: python -m benchmarks.collision_filter
+'''
+
+import time
+import pymunk as pm
+from pymunk import batch
+from source import simulation
+from source import constants as c
+from source.component import physics
+
+# (level, bird type of all the birds, ability frame)
+SCENES = [(6, 'black_bird', None), (3, 'white_bird', 30), (4, 'blue_bird', 25)]
+SHOT = (90, -0.3)
+
+def count_contacts(space, buffer):
+    buffer.clear()
+    batch.get_space_arbiters(space, batch.ArbiterFields.CONTACT_COUNT, buffer)
+    counts = memoryview(buffer.int_buf()).cast('P')
+    return len(counts), sum(counts)
+
+def run_scene(level_num, bird_type, ability_frame):
+    sim = simulation.Simulation(level_num)
+    for data in sim.map_data[c.BIRDS]:
+        data[c.TYPE] = bird_type
+    sim.reset()
+    buffer = batch.Buffer()
+    totals = {'arbiters': 0, 'contacts': 0, 'time': 0}
+    step = sim.step
+
+    def counting_step(mouse_pressed=False):
+        start = time.perf_counter()
+        step(mouse_pressed)
+        totals['time'] += time.perf_counter() - start
+        arbiters, contacts = count_contacts(sim.physics.space, buffer)
+        totals['arbiters'] += arbiters
+        totals['contacts'] += contacts
+    sim.step = counting_step
+
+    while sim.birds:
+        sim.shoot(*SHOT, ability_frame)
+    frames = sim.frame
+    return (totals['arbiters'] / frames, totals['contacts'] / frames,
+            totals['time'] / frames * 1000)
+
+def main():
+    filters = dict(physics.COLLISION_FILTERS)
+    print('level  bird        filter  arbiters/frame  contacts/frame  ms/frame')
+    for level_num, bird_type, ability_frame in SCENES:
+        for name in ('off', 'on'):
+            if name == 'off':
+                for collision_type in filters:
+                    physics.COLLISION_FILTERS[collision_type] = pm.ShapeFilter()
+            else:
+                physics.COLLISION_FILTERS.update(filters)
+            arbiters, contacts, ms = run_scene(level_num, bird_type, ability_frame)
+            print('%5d  %-10s  %6s  %14.1f  %14.1f  %8.3f' % (level_num, bird_type,
+                  name, arbiters, contacts, ms))
+
+if __name__ == '__main__':
+    main()
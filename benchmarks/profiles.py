@@ -0,0 +1,59 @@
+'''Measure the cost and the accuracy of the physics quality profiles.
+
+The same fixed shots are simulated on levels 1-6 under each profile of
+physics.PROFILES. For each profile the table shows the milliseconds of a
+frame and how far the outcomes drift from the accurate profile: the mean
+absolute difference of the score, the pigs killed and the blocks
+destroyed, and the part of the shots that kill the same pigs.
+
+Run from the project root: python -m benchmarks.profiles
+'''
+
+import time
+from source import simulation
+from source.component import physics
+
+LEVELS = range(1, 7)
+# (distance, angle, ability frame) of the shots, each shot is the first
+# bird of a freshly loaded level
+SHOTS = [(90, -0.3, 25), (100, -0.5, None), (80, -0.15, 40), (60, -0.8, 30)]
+
+def run(profile):
+    results = []
+    frames = 0
+    elapsed = 0
+    for level_num in LEVELS:
+        for distance, angle, ability_frame in SHOTS:
+            sim = simulation.Simulation(level_num, profile=profile)
+            start = time.perf_counter()
+            results.append(sim.shoot(distance, angle, ability_frame))
+            elapsed += time.perf_counter() - start
+            frames += sim.frame
+    return results, elapsed / frames * 1000
+
+def get_drift(results, reference):
+    drift = {'score': 0, 'pigs_killed': 0, 'blocks_destroyed': 0}
+    same = 0
+    for result, expected in zip(results, reference):
+        for key in drift:
+            drift[key] += abs(result[key] - expected[key]) / len(results)
+        if result['pigs_killed'] == expected['pigs_killed']:
+            same += 1
+    drift['same_pigs'] = same / len(results)
+    return drift
+
+def main():
+    reference, accurate_time = run(physics.PROFILE_ACCURATE)
+    print('profile      ms/frame  score drift  pigs drift  blocks drift  same pigs')
+    for profile in physics.PROFILES:
+        if profile == physics.PROFILE_ACCURATE:
+            results, ms = reference, accurate_time
+        else:
+            results, ms = run(profile)
+        drift = get_drift(results, reference)
+        print('%-11s  %8.3f  %11.1f  %10.2f  %12.2f  %8.0f%%' % (profile, ms,
+              drift['score'], drift['pigs_killed'], drift['blocks_destroyed'],
+              drift['same_pigs'] * 100))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''Frame time of the game on level 6 with the rendering options.
+
+The game runs in a window of the SDL dummy video driver unless
+SDL_VIDEODRIVER is set, with a fixed 60 FPS clock so every run sees the
+same frames: the auto shot of Level is released after 3 seconds and the
+blocks fall. The runs are:
+- no cache: every sprite is rotated again on every frame like before,
+  and constants.ROTATE_ANGLE_STEP is made tiny so the angles are not
+  rounded either;
+- cache: the rotated sprite cache;
+- dirty rects: the cache and constants.DIRTY_RECTS.
+All runs draw the background from the static layer of the level.
+The pushed column is the mean part of the window passed to
+pg.display.update. The dummy driver does not copy pixels to a screen, so
+it does not show what the smaller update saves.
+
+Run from the project root: python -m benchmarks.render
+'''
+
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import time
+import pygame as pg
+from source import tool
+from source import constants as c
+from source.state import level
+
+LEVEL_NUM = 6
+FRAMES = 600
+
+def run():
+    game = tool.Control()
+    game.game_info[c.LEVEL_NUM] = LEVEL_NUM
+    game.setup_states({c.LEVEL: level.Level()}, c.LEVEL)
+    ticks = [0]
+    get_ticks = pg.time.get_ticks
+    pg.time.get_ticks = lambda: ticks[0]
+    screen_area = c.SCREEN_WIDTH * c.SCREEN_HEIGHT
+    pushed = 0
+    try:
+        start = time.perf_counter()
+        for i in range(FRAMES):
+            ticks[0] = round((i + 1) * 1000 / 60)
+            game.update()
+            if game.state.dirty_rects is None:
+                pg.display.update()
+                pushed += 1
+            else:
+                pg.display.update(game.state.dirty_rects)
+                pushed += sum(rect.w * rect.h for rect in game.state.dirty_rects) / screen_area
+        return (time.perf_counter() - start) / FRAMES * 1000, pushed / FRAMES
+    finally:
+        pg.time.get_ticks = get_ticks
+
+def main():
+    tool.setup_display()
+    # the first run loads the level images and fonts
+    run()
+    print('level %d, %d frames' % (LEVEL_NUM, FRAMES))
+    print('mode         ms/frame  pushed')
+    get_rotated_image = tool.get_rotated_image
+    angle_step = c.ROTATE_ANGLE_STEP
+    tool.get_rotated_image = pg.transform.rotate
+    c.ROTATE_ANGLE_STEP = 1e-9
+    ms, pushed = run()
+    print('no cache     %8.3f  %5.1f%%' % (ms, pushed * 100))
+    tool.get_rotated_image = get_rotated_image
+    c.ROTATE_ANGLE_STEP = angle_step
+
+    tool.rotate_image.cache_clear()
+    ms, pushed = run()
+    print('cache        %8.3f  %5.1f%%' % (ms, pushed * 100))
+    info = tool.rotate_image.cache_info()
+
+    c.DIRTY_RECTS = True
+    ms, pushed = run()
+    c.DIRTY_RECTS = False
+    print('dirty rects  %8.3f  %5.1f%%' % (ms, pushed * 100))
+    print('cache hits %d, misses %d, images %d' % (info.hits, info.misses, info.currsize))
+
+if __name__ == '__main__':
+    main()
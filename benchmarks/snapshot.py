@@ -0,0 +1,51 @@
+'''Compare the cost of Physics snapshot/restore with a full level reset.
+
+The reset loads the map JSON and rebuilds every bird, pig and block like
+Level.reset does. The restore is measured after a shot, so the bodies
+destroyed by the shot are brought back.
+
+Run from the project root: python -m benchmarks.snapshot
+'''
+
+import time
+from source import tool
+from source import simulation
+
+REPEAT = 20
+SHOT = (90, -0.3, 25)
+
+def measure(func):
+    start = time.perf_counter()
+    for i in range(REPEAT):
+        func()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+def main():
+    print('level  bodies  reset ms  snapshot ms  restore ms')
+    for level_num in range(1, 7):
+        sim = simulation.Simulation(level_num)
+
+        def reset():
+            sim.map_data = tool.load_map_data(level_num)
+            sim.reset()
+        reset_time = measure(reset)
+
+        for i in range(120):
+            sim.step()
+        bodies = len(sim.physics.space.bodies)
+        snapshot_time = measure(sim.snapshot)
+
+        snap = sim.snapshot()
+        restore_time = 0
+        for i in range(REPEAT):
+            sim.shoot(*SHOT)
+            start = time.perf_counter()
+            sim.restore(snap)
+            restore_time += time.perf_counter() - start
+        restore_time = restore_time / REPEAT * 1000
+
+        print('%5d  %6d  %8.2f  %11.2f  %10.2f' % (level_num, bodies,
+              reset_time, snapshot_time, restore_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+'''Find where the threaded solver beats single-threaded stepping.
+
+Levels 1-6 and walls of wooden squares of growing size are stepped with
+the "solver" override of the map set to one and to two threads. The
+crossover is the smallest level from which two threads are faster on all
+the larger levels, it is the value to compare THREADED_MIN_BODIES with on
+the host.
+
+Run from the project root: python -m benchmarks.threaded
+'''
+
+import os
+import time
+from source import tool
+from source import simulation
+from source import constants as c
+from benchmarks.broadphase import get_tower, SHOT
+
+ROWS = [5, 10, 20, 40]
+FRAMES = 300
+# two threads must be this much faster to count as faster
+MARGIN = 0.05
+
+def run(map_data, threads):
+    sim = simulation.Simulation(1)
+    sim.map_data = dict(map_data)
+    sim.map_data[c.SOLVER] = {c.THREADS: threads}
+    sim.reset()
+    start = time.perf_counter()
+    sim.shoot(*SHOT, max_frames=FRAMES)
+    for i in range(FRAMES - sim.frame):
+        sim.step()
+    return (time.perf_counter() - start) / FRAMES * 1000
+
+def get_levels():
+    for level_num in range(1, 7):
+        map_data = tool.load_map_data(level_num)
+        yield 'level %d' % level_num, map_data
+    map_data = tool.load_map_data(1)
+    for rows in ROWS:
+        map_data = dict(map_data)
+        map_data[c.PIGS] = []
+        map_data[c.BLOCKS] = get_tower(rows)
+        yield 'tower %d' % rows, map_data
+
+def main():
+    print('cpus: %d' % (os.cpu_count() or 1))
+    print('level     bodies  1 thread ms  2 threads ms')
+    results = []
+    for name, map_data in get_levels():
+        bodies = len(map_data[c.PIGS]) + len(map_data[c.BLOCKS])
+        single = run(map_data, 1)
+        threaded = run(map_data, 2)
+        results.append((bodies, single, threaded))
+        print('%-8s  %6d  %11.3f  %12.3f' % (name, bodies, single, threaded))
+
+    # the crossover is where two threads stay faster for all larger levels
+    crossover = None
+    for bodies, single, threaded in sorted(results, reverse=True):
+        if threaded > single * (1 - MARGIN):
+            break
+        crossover = bodies
+    if crossover is None:
+        print('two threads are not faster on the largest level')
+    else:
+        print('two threads are faster from %d bodies' % crossover)
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,10 @@
 __author__ = 'marble_xu'
 
 import random
-import pygame as pg
 from .. import tool
 from .. import constants as c
+from . import events
+from . import physics
 
 def create_bird(type, x, y):
     bird = None
@@ -55,7 +56,7 @@ class Bird():
     def update(self, game_info, level, mouse_pressed):
         self.current_time = game_info[c.CURRENT_TIME]
         self.handle_state(level, mouse_pressed)
-        self.animation()
+        self.animation(level.physics.headless)
 
     def handle_state(self, level, mouse_pressed):
         if self.state == c.IDLE:
@@ -78,20 +79,23 @@ class Bird():
         pass
 
     def check_attack_finish(self):
+        '''the bird is done when its body moved less than 10 pixels in half a
+           second, the sprite is not used as its size changes with rotation'''
+        x, y = self.phy.body.position
         if self.pos_timer == 0:
             self.pos_timer = self.current_time
-            self.old_pos = (self.rect.x, self.rect.y)
+            self.old_pos = (x, y)
         elif (self.current_time - self.pos_timer) > 500:
-            distance = tool.distance(self.old_pos[0], self.old_pos[1], self.rect.x, self.rect.y)
+            distance = tool.distance(self.old_pos[0], self.old_pos[1], x, y)
             if distance < 10:
                 if self.name == c.BLACK_BIRD:
                     self.state = c.INIT_EXPLODE
                 else:
                     self.state = c.DEAD
             self.pos_timer = self.current_time
-            self.old_pos = (self.rect.x, self.rect.y)
+            self.old_pos = (x, y)
 
-    def animation(self):
+    def animation(self, headless=False):
         if self.state == c.INIT_EXPLODE:
             interval = 400
         elif self.state == c.EXPLODE:
@@ -115,7 +119,10 @@ class Bird():
             self.animate_timer = self.current_time
         
         image = self.frames[self.frame_index]
-        self.image = pg.transform.rotate(image, self.angle_degree)
+        if headless:
+            self.image = image
+        else:
+            self.image = tool.get_rotated_image(image, self.angle_degree)
 
     def change_image(self, frames):
         self.frames = frames
@@ -186,7 +193,8 @@ class BlueBird(Bird):
                 old = self.phy.body.velocity
                 vec_y = old[1] * 0.5 * sign
                 bird.phy.body.velocity = (old[0], vec_y)
-                print('bluebird:[', x, ',', y, ']', 'old:', old, '  new:', bird.phy.body.velocity)
+                level.physics.events.record(events.EVENT_BLUE_BIRD_SPLIT, bird.phy.shape.collision_type,
+                                            0, bird, bird.phy.body.velocity.length)
 
 class YellowBird(Bird):
     def __init__(self, x, y):
@@ -204,7 +212,8 @@ class YellowBird(Bird):
             self.clicked = True
             # speed velocity of bird when first mouse click
             self.phy.body.velocity = self.phy.body.velocity * 3
-            print('yellow bird:', self.phy.body.velocity)
+            level.physics.events.record(events.EVENT_YELLOW_BIRD_SPEEDUP, self.phy.shape.collision_type,
+                                        0, self, self.phy.body.velocity.length)
 
 class BlackBird(Bird):
     def __init__(self, x, y):
@@ -265,7 +274,8 @@ class WhiteBird(Bird):
             self.clicked = True
             vel_x, vel_y = self.phy.body.velocity
             self.phy.body.velocity = (vel_x * 2, vel_y + 1000)
-            egg = Egg(self.rect.centerx, self.rect.bottom + 30)
+            x, y = physics.to_pygame(self.phy.body.position)
+            egg = Egg(x, y + self.rect.h // 2 + 30)
             level.physics.add_egg(egg)
 
 class Egg(Bird):
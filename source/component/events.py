@@ -0,0 +1,103 @@
+'''Collision, damage and ability events of the physics.
+
+The collision handlers and the birds write events to a preallocated ring
+buffer: one record is a row of numpy arrays set in place, with no string
+formatting and no I/O in the steps. There is a single writer, the game
+loop, so the buffer needs no lock. Physics drains the buffer to its sinks
+once per frame, after the steps, and only when a sink is set.
+'''
+
+import numpy as np
+
+EVENT_PIG_DAMAGE = 1
+EVENT_BLOCK_DAMAGE = 2
+EVENT_BLUE_BIRD_SPLIT = 3
+EVENT_YELLOW_BIRD_SPEEDUP = 4
+
+EVENT_NAMES = {
+    EVENT_PIG_DAMAGE: 'pig damage',
+    EVENT_BLOCK_DAMAGE: 'block damage',
+    EVENT_BLUE_BIRD_SPLIT: 'blue bird split',
+    EVENT_YELLOW_BIRD_SPEEDUP: 'yellow bird speedup',
+}
+
+# type_a and type_b are the collision types of the pair, type_b is 0 for
+# the damage of an explosion. entity is the id() of the damaged pig or
+# block or of the bird, impulse is the speed of the bird for ability events
+EVENT_DTYPE = np.dtype([('kind', np.int8), ('type_a', np.int8), ('type_b', np.int8),
+                        ('entity', np.uint64), ('impulse', np.float64),
+                        ('damage', np.float64), ('life', np.float64)])
+RING_SIZE = 4096
+
+class EventRing():
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.kind = np.zeros(size, np.int8)
+        self.type_a = np.zeros(size, np.int8)
+        self.type_b = np.zeros(size, np.int8)
+        self.entity = np.zeros(size, np.uint64)
+        self.impulse = np.zeros(size)
+        self.damage = np.zeros(size)
+        self.life = np.zeros(size)
+        # number of events written and drained since the start, an event
+        # that is not drained before size newer ones is overwritten
+        self.head = 0
+        self.tail = 0
+        self.lost = 0
+        self.sinks = []
+
+    def record(self, kind, type_a, type_b, entity, impulse=0, damage=0, life=0):
+        i = self.head % self.size
+        self.kind[i] = kind
+        self.type_a[i] = type_a
+        self.type_b[i] = type_b
+        self.entity[i] = id(entity)
+        self.impulse[i] = impulse
+        self.damage[i] = damage
+        self.life[i] = life
+        self.head += 1
+
+    def drain(self):
+        '''return the events written since the last drain, oldest first, as
+           an array of EVENT_DTYPE and pass them to the sinks'''
+        start = max(self.tail, self.head - self.size)
+        self.lost += start - self.tail
+        index = np.arange(start, self.head) % self.size
+        events = np.empty(len(index), EVENT_DTYPE)
+        for name in EVENT_DTYPE.names:
+            events[name] = getattr(self, name)[index]
+        self.tail = self.head
+        for sink in self.sinks:
+            sink.write(events)
+        return events
+
+class EventLog():
+    '''sink writing a line of text per event to an open file'''
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, events):
+        for event in events.tolist():
+            kind, type_a, type_b, entity, impulse, damage, life = event
+            self.file.write('%s: pair (%d, %d) entity %x impulse %.1f damage %d life %d\n' %
+                            (EVENT_NAMES[kind], type_a, type_b, entity, impulse, damage, life))
+
+class EventStats():
+    '''sink counting the events, the impulse and damage of each kind'''
+    def __init__(self):
+        self.count = {}
+        self.impulse = {}
+        self.damage = {}
+
+    def write(self, events):
+        for kind in np.unique(events['kind']).tolist():
+            mask = events['kind'] == kind
+            self.count[kind] = self.count.get(kind, 0) + int(mask.sum())
+            self.impulse[kind] = self.impulse.get(kind, 0) + float(events['impulse'][mask].sum())
+            self.damage[kind] = self.damage.get(kind, 0) + float(events['damage'][mask].sum())
+
+    def get_summary(self):
+        return {EVENT_NAMES[kind]: {'count': self.count[kind],
+                                    'impulse': self.impulse[kind],
+                                    'damage': self.damage[kind]}
+                for kind in self.count}
@@ -1,21 +1,111 @@
 __author__ = 'marble_xu'
 
+import functools
+import io
 import math
+import os
+import pickle
+import sys
+import time
+import numpy as np
 import pygame as pg
 import pymunk as pm
 from pymunk import Vec2d
+from pymunk import batch
 from .. import tool
 from .. import constants as c
+from . import events
+from . import stats
 
 COLLISION_BIRD = 1
 COLLISION_PIG = 2
 COLLISION_BLOCK = 3
 COLLISION_LINE = 4
-COLLISION_EXPLODE = 5
 COLLISION_EGG = 6
 
+# collision categories: the birds and eggs only hit pigs, blocks and the
+# ground, the pairs between them have no handler and are dropped by the
+# broadphase before any contact is computed
+CATEGORY_BIRD = 0b1
+CATEGORY_PIG = 0b10
+CATEGORY_BLOCK = 0b100
+CATEGORY_LINE = 0b1000
+CATEGORY_EGG = 0b10000
+COLLISION_FILTERS = {
+    COLLISION_BIRD: pm.ShapeFilter(categories=CATEGORY_BIRD,
+                                   mask=CATEGORY_PIG | CATEGORY_BLOCK | CATEGORY_LINE),
+    COLLISION_PIG: pm.ShapeFilter(categories=CATEGORY_PIG),
+    COLLISION_BLOCK: pm.ShapeFilter(categories=CATEGORY_BLOCK),
+    COLLISION_LINE: pm.ShapeFilter(categories=CATEGORY_LINE),
+    COLLISION_EGG: pm.ShapeFilter(categories=CATEGORY_EGG,
+                                  mask=CATEGORY_PIG | CATEGORY_BLOCK | CATEGORY_LINE),
+}
+
 BIRD_IMPULSE_TIMES = 3
 MIN_DAMAGE_IMPULSE = 300
+GRAVITY = -700.0
+# impulse of the sling per pixel of pulled rope
+LAUNCH_POWER = 53
+# pymunk time between two points of the aim preview, the same spacing as
+# the bird path that records a point every 50 ms of game time
+PREVIEW_TIME = 0.03
+PREVIEW_POINT_NUM = 60
+# seconds a group of bodies must be idle before it falls asleep
+SLEEP_TIME_THRESHOLD = 0.5
+# bodies slower than this speed (pixels per second) count as idle, stacked
+# towers keep jittering above the default estimate of pymunk
+IDLE_SPEED_THRESHOLD = 5.0
+# an explosion hits the bodies in range like EXPLOSION_FRAGMENTS fragments
+# of the explosion mass thrown out at EXPLOSION_SPEED pixels per second
+EXPLOSION_SPEED = 2000
+EXPLOSION_FRAGMENTS = 12
+
+# game time of a frame at 60 FPS in milliseconds
+FRAME_TIME = 1000 / 60
+# at most three frames of steps are caught up after a slow frame
+MAX_CATCHUP_FRAMES = 3
+# the steps of a frame are split further so that no body moves more than
+# this part of the thinnest pig or block in one step, up to SUBSTEP_SCALE
+# times the steps of the profile. A frame where all bodies sleep is
+# simulated in one step
+TUNNEL_FRACTION = 0.25
+SUBSTEP_SCALE = 4
+
+# quality profiles of the physics. A frame is substeps steps of dt, dt times
+# substeps is the same in all profiles so the game runs at the same speed.
+# The game is tuned for the interactive profile, the cheap solver profile
+# is for headless batch runs, see benchmarks/profiles.py for their cost and
+# how far the outcomes drift from the accurate profile
+PROFILE_SOLVER = 'solver'
+PROFILE_INTERACTIVE = 'interactive'
+PROFILE_ACCURATE = 'accurate'
+PROFILES = {
+    PROFILE_SOLVER: {'gravity': GRAVITY, 'dt': 0.0025, 'substeps': 4,
+                     'iterations': 6, 'collision_slop': 0.2},
+    PROFILE_INTERACTIVE: {'gravity': GRAVITY, 'dt': 0.002, 'substeps': 5,
+                          'iterations': 10, 'collision_slop': 0.1},
+    PROFILE_ACCURATE: {'gravity': GRAVITY, 'dt': 0.001, 'substeps': 10,
+                       'iterations': 20, 'collision_slop': 0.05},
+}
+
+# levels with at least this many pigs and blocks are stepped on two threads
+# when the host has more than one cpu, see benchmarks/threaded.py
+THREADED_MIN_BODIES = 400
+# the threaded solver of pymunk runs on at most two threads
+MAX_THREADS = 2
+
+# the spatial hash is only faster than the bounding box tree of pymunk for
+# a lot of shapes of about the same size, see benchmarks/broadphase.py
+HASH_MIN_SHAPES = 2000
+# largest ratio between the size of a shape and the median size
+HASH_MAX_SIZE_RATIO = 2.0
+# cell size of the hash in median shape sizes and cells per shape
+HASH_CELL_SCALE = 1.5
+HASH_CELLS_PER_SHAPE = 10
+
+# state of a body read by BodyArray, five floats per body
+BODY_FIELDS = (batch.BodyFields.BODY_ID | batch.BodyFields.POSITION
+               | batch.BodyFields.ANGLE | batch.BodyFields.VELOCITY)
 
 def to_pygame(p):
     """Convert position of pymunk to position of pygame"""
@@ -25,24 +115,286 @@ def to_pymunk(x, y):
     """Convert position of pygame to position of pymunk"""
     return (x, -(y-600))
 
-class Physics():
+def get_entity_state(entity):
+    '''shallow copy of the attributes of a bird, pig or block, the rect is
+       the only attribute changed in place'''
+    state = dict(vars(entity))
+    state['rect'] = entity.rect.copy()
+    return state
+
+def set_entity_state(entity, state):
+    entity.__dict__.clear()
+    entity.__dict__.update(state)
+    entity.rect = state['rect'].copy()
+
+def get_solver(map_data=None, threads=None, iterations=None):
+    '''(threads, iterations) of the space of a level. The "solver" value of
+       the map file, a dict with "threads" and "iterations", wins over the
+       values of the Physics. Without threads, the level is stepped on two
+       threads if it has THREADED_MIN_BODIES pigs and blocks, without
+       iterations the default of the interactive profile is used'''
+    solver = map_data.get(c.SOLVER, {}) if map_data else {}
+    threads = solver.get(c.THREADS, threads)
+    iterations = solver.get(c.ITERATIONS, iterations)
+    if threads is None:
+        threads = 1
+        if map_data and (os.cpu_count() or 1) > 1:
+            if len(map_data[c.PIGS]) + len(map_data[c.BLOCKS]) >= THREADED_MIN_BODIES:
+                threads = MAX_THREADS
+    if iterations is None:
+        iterations = PROFILES[PROFILE_INTERACTIVE]['iterations']
+    return (max(1, min(threads, MAX_THREADS)), iterations)
+
+def get_broadphase(sizes, override=None):
+    '''choose the spatial index of a level from the sizes of its shapes.
+       Return None for the bounding box tree or the (dim, count) of a
+       spatial hash. override is the broadphase value of the map file:
+       "tree", "hash" for a hash sized from the shapes, or a dict with
+       the "dim" and "count" of the hash'''
+    if isinstance(override, dict):
+        return (float(override['dim']), int(override['count']))
+    if override == c.BROADPHASE_TREE or len(sizes) == 0:
+        return None
+    sizes = sorted(sizes)
+    median = sizes[len(sizes)//2]
+    if override != c.BROADPHASE_HASH:
+        if len(sizes) < HASH_MIN_SHAPES:
+            return None
+        if sizes[-1] > median * HASH_MAX_SIZE_RATIO or sizes[0] * HASH_MAX_SIZE_RATIO < median:
+            return None
+    return (median * HASH_CELL_SCALE, len(sizes) * HASH_CELLS_PER_SHAPE)
+
+class SpacePickler(pickle.Pickler):
+    '''the collision handlers are bound methods of Physics, keep a reference
+       to the Physics instead of pickling it with all its entities'''
+    def __init__(self, file, physics):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.physics = physics
+
+    def persistent_id(self, obj):
+        if obj is self.physics:
+            return 'physics'
+        return None
+
+class SpaceUnpickler(pickle.Unpickler):
+    def __init__(self, file, physics):
+        pickle.Unpickler.__init__(self, file)
+        self.physics = physics
+
+    def persistent_load(self, pid):
+        return self.physics
+
+class EntityList():
+    '''unordered list of birds, pigs, blocks or eggs.
+       remove() only marks an entity, flush() at the end of the frame frees
+       its slot in O(1) by moving the last entity into it, so the list can
+       be removed from while it is iterated'''
+    def __init__(self, entities=()):
+        self.entities = list(entities)
+        self.index = {entity: i for i, entity in enumerate(self.entities)}
+        self.removed = {}
+
+    def __iter__(self):
+        return iter(self.entities)
+
+    def __len__(self):
+        return len(self.entities) - len(self.removed)
+
+    def append(self, entity):
+        self.index[entity] = len(self.entities)
+        self.entities.append(entity)
+
+    def remove(self, entity):
+        if entity in self.index:
+            self.removed[entity] = None
+
+    def flush(self):
+        for entity in self.removed:
+            i = self.index.pop(entity)
+            last = self.entities.pop()
+            if last is not entity:
+                self.entities[i] = last
+                self.index[last] = i
+        self.removed = {}
+
+class BodyArray():
+    '''structure of arrays mirror of the bodies in the space, one row per
+       body with its pymunk state, the collision type and life of its entity.
+       The state of all bodies is read in one batch call of pymunk, the
+       conversion to pygame and the tests of the rows run on whole arrays'''
     def __init__(self):
+        self.buffer = batch.Buffer()
+        self.ids = np.zeros(0, np.uintp)
+        self.entities = []
+        self.rows = {}
+        self.types = np.zeros(0, np.int64)
+        self.life = np.zeros(0)
+        self.state = np.zeros((0, 5))
+        self.prev_ids = None
+        self.prev_state = None
+        # pygame x, y and angle in degrees the sprite of a row was drawn with
+        self.drawn = np.zeros((0, 3))
+        # set when a body is added or removed, the rows are built again
+        self.dirty = True
+
+    def fetch(self, space):
+        '''ids and x, y, angle, velocity x, velocity y of all bodies, the
+           arrays are views of the buffer and change on the next fetch'''
+        self.buffer.clear()
+        batch.get_space_bodies(space, BODY_FIELDS, self.buffer)
+        ids = np.frombuffer(self.buffer.int_buf(), np.uintp)
+        state = np.frombuffer(self.buffer.float_buf(), np.float64).reshape(-1, 5)
+        return ids, state
+
+    def get_max_speed(self, space):
+        '''speed of the fastest body, from the last refresh unless a body was
+           added or removed since'''
+        if self.dirty:
+            ids, state = self.fetch(space)
+        else:
+            state = self.state
+        if len(state) == 0:
+            return 0
+        return float(np.hypot(state[:, 3], state[:, 4]).max())
+
+    def get_arbiter_num(self, space):
+        '''number of active contacts of the space'''
+        self.buffer.clear()
+        batch.get_space_arbiters(space, batch.ArbiterFields.BODY_A_ID, self.buffer)
+        return len(self.buffer.int_buf()) // np.dtype(np.uintp).itemsize
+
+    def save_previous(self, space):
+        ids, state = self.fetch(space)
+        self.prev_ids = ids.copy()
+        self.prev_state = state.copy()
+
+    def refresh(self, space, shape_entities):
+        ids, state = self.fetch(space)
+        if self.dirty or not np.array_equal(ids, self.ids):
+            self.build(ids, shape_entities)
+        self.state = state.copy()
+
+    def build(self, ids, shape_entities):
+        body_entities = {shape.body.id: entity for shape, entity in shape_entities.items()}
+        self.ids = ids.copy()
+        self.entities = [body_entities.get(id) for id in ids.tolist()]
+        self.rows = {entity: i for i, entity in enumerate(self.entities) if entity is not None}
+        self.types = np.array([0 if entity is None else entity.phy.shape.collision_type
+                               for entity in self.entities], np.int64)
+        self.life = np.array([getattr(entity, 'life', math.inf)
+                              for entity in self.entities], np.float64)
+        self.drawn = np.full((len(ids), 3), np.nan)
+        self.dirty = False
+
+    def set_life(self, entity):
+        '''called after the entity is damaged, the image of a damaged block
+           changes so its sprite is drawn again even if it does not move'''
+        row = self.rows.get(entity)
+        if row is not None:
+            self.life[row] = entity.life
+            self.drawn[row] = np.nan
+
+    def get_removed(self):
+        '''entities that fell out of the screen or died'''
+        x, y = self.state[:, 0], self.state[:, 1]
+        types = self.types
+        removed = (((types == COLLISION_BIRD) & ((y < 0) | (x > c.SCREEN_WIDTH * 2)))
+                   | ((types == COLLISION_PIG) & ((y < 0) | (self.life <= 0)))
+                   | ((types == COLLISION_BLOCK) & (self.life <= 0)))
+        return [self.entities[i] for i in np.flatnonzero(removed).tolist()]
+
+    def get_draw_state(self, alpha):
+        '''pygame x, y and angle in degrees of every row, interpolated from
+           the state before the last step by alpha'''
+        state = self.state[:, :3]
+        if self.prev_state is not None and np.array_equal(self.prev_ids, self.ids):
+            prev = self.prev_state[:, :3]
+            state = prev + (state - prev) * alpha
+        draw = np.empty_like(state)
+        draw[:, 0] = np.trunc(state[:, 0])
+        draw[:, 1] = np.trunc(600 - state[:, 1])
+        # the sprites are rotated in steps, a smaller turn does not move them
+        step = c.ROTATE_ANGLE_STEP
+        draw[:, 2] = np.round(np.degrees(state[:, 2]) / step) * step
+        return draw
+
+    def get_moved(self, alpha, headless):
+        '''rows and draw state of the entities whose sprite is out of date,
+           the pigs and blocks are not drawn when headless'''
+        draw = self.get_draw_state(alpha)
+        moved = np.any(draw != self.drawn, axis=1) & (self.types != 0)
+        if headless:
+            moved &= (self.types == COLLISION_BIRD) | (self.types == COLLISION_EGG)
+        self.drawn[moved] = draw[moved]
+        rows = np.flatnonzero(moved)
+        return rows.tolist(), draw[rows].tolist()
+
+class Physics():
+    def __init__(self, sleep_time_threshold=SLEEP_TIME_THRESHOLD,
+                 idle_speed_threshold=IDLE_SPEED_THRESHOLD, threads=None, iterations=None,
+                 profile=PROFILE_INTERACTIVE, record_stats=False, headless=False):
+        '''sleep_time_threshold is the idle time before resting bodies sleep,
+           None turns sleeping off. threads and iterations configure the
+           solver, see get_solver, iterations defaults to the value of the
+           profile, a name of PROFILES. The steps on two threads are not
+           deterministic, a snapshot or replay needs threads=1. With
+           record_stats every level gets a new stats.FrameStats. A headless
+           world does not rotate or sync the sprites of pigs and blocks'''
+        self.profile_name = profile
+        self.profile = PROFILES[profile]
+        self.sleep_time_threshold = sleep_time_threshold
+        self.idle_speed_threshold = idle_speed_threshold
+        self.threads = threads
+        self.iterations = iterations
+        self.record_stats = record_stats
+        self.headless = headless
+        self.events = events.EventRing()
+        if c.DEBUG:
+            self.events.sinks.append(events.EventLog(sys.stdout))
         self.reset()
 
     def reset(self, level=None):
         self.level = level
+        # the map of the level is loaded before the reset
+        iterations = self.iterations
+        if iterations is None:
+            iterations = self.profile['iterations']
+        self.solver = get_solver(getattr(level, 'map_data', None), self.threads, iterations)
+        threads, iterations = self.solver
         # init space: set gravity and dt
-        self.space = pm.Space()
-        self.space.gravity = (0.0, -700.0)
-        self.dt = 0.002
-        self.birds = []
-        self.pigs = []
-        self.blocks = []
-        self.explodes = []
-        self.eggs = []
+        self.space = pm.Space(threaded=threads > 1)
+        self.space.threads = threads
+        self.space.iterations = iterations
+        self.space.gravity = (0.0, self.profile['gravity'])
+        self.space.collision_slop = self.profile['collision_slop']
+        if self.sleep_time_threshold is not None:
+            # sleeping bodies are skipped by the solver and the sprite sync,
+            # they are woken up by a contact with an awake body or an impulse
+            self.space.sleep_time_threshold = self.sleep_time_threshold
+            self.space.idle_speed_threshold = self.idle_speed_threshold
+        self.dt = self.profile['dt']
+        self.substeps = self.profile['substeps']
+        # game time in milliseconds simulated by a step of dt
+        self.step_time = FRAME_TIME / self.substeps
+        self.broadphase = None
+        # smallest width of the pigs and blocks, used by get_substeps
+        self.thinnest = math.inf
+        self.last_time = None
+        self.accumulator = 0
+        self.alpha = 1
+        self.birds = EntityList()
+        self.pigs = EntityList()
+        self.blocks = EntityList()
+        self.eggs = EntityList()
+        # map pymunk shape to its bird, pig, block or egg for the collision handlers
+        self.shape_entities = {}
+        self.bodies = BodyArray()
+        # (shape, impulse, collision type of the other shape) of the hits on
+        # pigs and blocks of the frame, resolved by apply_damage
+        self.damage_records = []
         self.path_timer = 0
         self.check_collide = False
-        self.explode_timer = 0
+        self.stats = stats.FrameStats() if self.record_stats else None
         self.setup_lines()
         self.setup_collision_handler()
 
@@ -56,105 +408,99 @@ class Physics():
             line.elasticity = 0.95
             line.friction = 1
             line.collision_type = COLLISION_LINE
+            line.filter = COLLISION_FILTERS[COLLISION_LINE]
         self.space.add(static_body, *static_lines)
         self.static_lines = static_lines
 
     def setup_collision_handler(self):
-        def post_solve_bird_line(arbiter, space, data):
-            if self.check_collide:
-                bird_shape = arbiter.shapes[0]
-                my_phy.handle_bird_collide(bird_shape, True)
-        def post_solve_pig_bird(arbiter, space, data):
-            if self.check_collide:
-                pig_shape = arbiter.shapes[0]
-                my_phy.handle_pig_collide(pig_shape, arbiter.total_impulse.length * BIRD_IMPULSE_TIMES)
-        def post_solve_pig_line(arbiter, space, data):
-            if self.check_collide:
-                pig_shape = arbiter.shapes[0]
-                my_phy.handle_pig_collide(pig_shape, arbiter.total_impulse.length, True)
-        def post_solve_pig_block(arbiter, space, data):
-            if self.check_collide:
-                if arbiter.total_impulse.length >= MIN_DAMAGE_IMPULSE:
-                    pig_shape = arbiter.shapes[0]
-                    my_phy.handle_pig_collide(pig_shape, arbiter.total_impulse.length)
-        def post_solve_block_bird(arbiter, space, data):
-            if self.check_collide:
-                block_shape, bird_shape = arbiter.shapes
-                my_phy.handle_bird_collide(bird_shape)
-                if arbiter.total_impulse.length >= MIN_DAMAGE_IMPULSE:
-                    my_phy.handle_block_collide(block_shape, arbiter.total_impulse.length)
-
-        def post_solve_block_explode(arbiter, space, data):
-            if self.check_collide:
-                block_shape = arbiter.shapes[0]
-                if arbiter.total_impulse.length > MIN_DAMAGE_IMPULSE:
-                    my_phy.handle_block_collide(block_shape, arbiter.total_impulse.length)
-
-        def post_solve_pig_explode(arbiter, space, data):
-            if self.check_collide:
+        # pymunk only calls into python for the pairs registered here, the
+        # first shape of the arbiter has the first collision type of the pair
+        self.collision_handlers = {
+            (COLLISION_BIRD, COLLISION_LINE): self.post_solve_bird_line,
+            (COLLISION_PIG, COLLISION_BIRD): self.post_solve_pig_bird,
+            (COLLISION_PIG, COLLISION_LINE): self.post_solve_pig_line,
+            (COLLISION_PIG, COLLISION_BLOCK): self.post_solve_pig_block,
+            (COLLISION_BLOCK, COLLISION_BIRD): self.post_solve_block_bird,
+            (COLLISION_EGG, COLLISION_LINE): self.post_solve_egg,
+            (COLLISION_EGG, COLLISION_BLOCK): self.post_solve_egg,
+            (COLLISION_EGG, COLLISION_PIG): self.post_solve_egg,
+        }
+        for (type_a, type_b), handler in self.collision_handlers.items():
+            if self.stats is not None:
+                handler = functools.partial(self.post_solve_counted, handler)
+            self.space.on_collision(type_a, type_b, post_solve=handler)
+
+    def post_solve_counted(self, handler, arbiter, space, data):
+        self.stats.callback_num += 1
+        handler(arbiter, space, data)
+
+    def post_solve_bird_line(self, arbiter, space, data):
+        if self.check_collide:
+            bird_shape = arbiter.shapes[0]
+            self.handle_bird_collide(bird_shape, True)
+
+    def post_solve_pig_bird(self, arbiter, space, data):
+        if self.check_collide:
+            pig_shape = arbiter.shapes[0]
+            self.handle_pig_collide(pig_shape, arbiter.total_impulse.length * BIRD_IMPULSE_TIMES,
+                                    other_type=COLLISION_BIRD)
+
+    def post_solve_pig_line(self, arbiter, space, data):
+        if self.check_collide:
+            pig_shape = arbiter.shapes[0]
+            self.handle_pig_collide(pig_shape, arbiter.total_impulse.length, True)
+
+    def post_solve_pig_block(self, arbiter, space, data):
+        if self.check_collide:
+            if arbiter.total_impulse.length >= MIN_DAMAGE_IMPULSE:
                 pig_shape = arbiter.shapes[0]
-                if arbiter.total_impulse.length > MIN_DAMAGE_IMPULSE:
-                    my_phy.handle_pig_collide(pig_shape, arbiter.total_impulse.length)
-
-        def post_solve_egg(arbiter, space, data):
-            if self.check_collide:
-                egg_shape = arbiter.shapes[0]
-                my_phy.handle_egg_collide(egg_shape)
-
-        # Register collision handlers using the new pymunk 7.x API
-        def collision_handler(arbiter, space, data):
-            shape_a, shape_b = arbiter.shapes
-            collision_type_a = shape_a.collision_type
-            collision_type_b = shape_b.collision_type
-            
-            # Sort to ensure consistent order
-            if collision_type_a > collision_type_b:
-                collision_type_a, collision_type_b = collision_type_b, collision_type_a
-                shape_a, shape_b = shape_b, shape_a
-            
-            # Handle different collision types
-            if (collision_type_a, collision_type_b) == (COLLISION_BIRD, COLLISION_LINE):
-                post_solve_bird_line(arbiter, space, data)
-            elif (collision_type_a, collision_type_b) == (COLLISION_BIRD, COLLISION_PIG):
-                post_solve_pig_bird(arbiter, space, data)
-            elif (collision_type_a, collision_type_b) == (COLLISION_LINE, COLLISION_PIG):
-                post_solve_pig_line(arbiter, space, data)
-            elif (collision_type_a, collision_type_b) == (COLLISION_BLOCK, COLLISION_PIG):
-                post_solve_pig_block(arbiter, space, data)
-            elif (collision_type_a, collision_type_b) == (COLLISION_BIRD, COLLISION_BLOCK):
-                post_solve_block_bird(arbiter, space, data)
-            elif (collision_type_a, collision_type_b) == (COLLISION_BLOCK, COLLISION_EXPLODE):
-                post_solve_block_explode(arbiter, space, data)
-            elif (collision_type_a, collision_type_b) == (COLLISION_EXPLODE, COLLISION_PIG):
-                post_solve_pig_explode(arbiter, space, data)
-            elif (collision_type_a, collision_type_b) == (COLLISION_EGG, COLLISION_LINE) or \
-                 (collision_type_a, collision_type_b) == (COLLISION_BLOCK, COLLISION_EGG) or \
-                 (collision_type_a, collision_type_b) == (COLLISION_EGG, COLLISION_PIG):
-                post_solve_egg(arbiter, space, data)
-                
-            return True
-        
-        self.space.on_collision = collision_handler
+                self.handle_pig_collide(pig_shape, arbiter.total_impulse.length,
+                                        other_type=COLLISION_BLOCK)
+
+    def post_solve_block_bird(self, arbiter, space, data):
+        if self.check_collide:
+            block_shape, bird_shape = arbiter.shapes
+            self.handle_bird_collide(bird_shape)
+            if arbiter.total_impulse.length >= MIN_DAMAGE_IMPULSE:
+                self.handle_block_collide(block_shape, arbiter.total_impulse.length, COLLISION_BIRD)
+
+    def post_solve_egg(self, arbiter, space, data):
+        if self.check_collide:
+            egg_shape = arbiter.shapes[0]
+            self.handle_egg_collide(egg_shape)
 
     def enable_check_collide(self):
         self.check_collide = True
 
+    def setup_broadphase(self, override=None):
+        '''called once the pigs and blocks of the level are added'''
+        sizes = []
+        for shape in self.shape_entities:
+            bb = shape.bb
+            sizes.append(max(bb.right - bb.left, bb.top - bb.bottom))
+        self.broadphase = get_broadphase(sizes, override)
+        if self.broadphase is not None:
+            self.space.use_spatial_hash(*self.broadphase)
+
     def add_bird(self, bird, distance, angle, x, y):
         x, y = to_pymunk(x, y)
         radius = bird.get_radius()
         phybird = PhyBird(distance, angle, x, y, self.space, bird.get_radius(), bird.mass)
         bird.set_physics(phybird)
+        self.add_entity(bird)
         self.birds.append(bird)
 
     def add_egg(self, egg):
         x, y = to_pymunk(egg.rect.centerx, egg.rect.centery)
         phy = PhyEgg((x, y), egg.rect.w, egg.rect.h, self.space, 10)
         egg.set_physics(phy)
+        self.add_entity(egg)
         self.eggs.append(egg)
 
     def add_bird_by_copy(self, bird, body):
         phybird = PhyBird2(body, self.space)
         bird.set_physics(phybird)
+        self.add_entity(bird)
         self.birds.append(bird)
         
     def add_pig(self, pig):
@@ -163,6 +509,7 @@ class Physics():
         radius = pig.rect.w//2
         phypig = PhyPig(x, y, radius, self.space)
         pig.set_physics(phypig)
+        self.add_entity(pig)
         self.pigs.append(pig)
 
     def add_block(self, block):
@@ -177,136 +524,271 @@ class Physics():
             phy = PhyCircle((x, y), radius, self.space, block.mass)
         if phy:
             block.set_physics(phy)
+            self.add_entity(block)
             self.blocks.append(block)
         else:
             print('not support block type:', block.name)
 
-    def add_explode(self, pos, angle, length, mass):
-        phyexplode = PhyExplode(pos, angle, length, self.space, mass)
-        self.explodes.append(phyexplode)
+    def add_entity(self, entity):
+        shape = entity.phy.shape
+        shape.filter = COLLISION_FILTERS[shape.collision_type]
+        self.shape_entities[shape] = entity
+        if shape.collision_type in (COLLISION_PIG, COLLISION_BLOCK):
+            bb = shape.bb
+            self.thinnest = min(self.thinnest, bb.right - bb.left, bb.top - bb.bottom)
+        self.bodies.dirty = True
+
+    def remove_entity(self, entity):
+        shape = entity.phy.shape
+        self.space.remove(shape, shape.body)
+        del self.shape_entities[shape]
+        self.bodies.dirty = True
 
     def create_explosion(self, pos, radius, length, mass):
-        ''' parameter pos is the pymunk position'''
-        explode_num = 12
-        sub_pi = math.pi * 2 / explode_num
-        for i in range(explode_num):
-            angle = sub_pi * i
-            x = pos[0] + radius * math.sin(angle)
-            y = pos[1] + radius * math.cos(angle)
-            # angle value must calculated by math.pi * 2
-            self.add_explode((x,y), angle, length, mass)
-
-    def check_explosion(self):
-        explodes_to_remove = []
-        if len(self.explodes) == 0:
+        ''' parameter pos is the pymunk position. The blast starts at radius
+            and reaches length further, the pigs and blocks in range are
+            found by one query and get a radial impulse and damage that
+            fall off with the distance'''
+        if self.stats is not None:
+            start = time.perf_counter()
+        pos = Vec2d(*pos)
+        power = mass * EXPLOSION_SPEED
+        for info in self.space.point_query(pos, radius + length, pm.ShapeFilter()):
+            shape = info.shape
+            if shape.collision_type not in (COLLISION_PIG, COLLISION_BLOCK):
+                continue
+            falloff = 1 - max(0, info.distance - radius) / length
+            if falloff <= 0:
+                continue
+            body = shape.body
+            direction = body.position - pos
+            if direction.length == 0:
+                direction = Vec2d(0, 1)
+            # count the fragments that fly into the body from the angle it
+            # covers, each one is stopped by the body
+            bb = shape.bb
+            size = max(bb.right - bb.left, bb.top - bb.bottom) / 2
+            view = 2 * math.atan2(size, max(direction.length, 1))
+            hits = int(view / (2 * math.pi) * EXPLOSION_FRAGMENTS)
+            hits = min(EXPLOSION_FRAGMENTS, max(1, hits))
+            impulse = power * body.mass / (mass + body.mass) * falloff * hits
+            body.apply_impulse_at_world_point(direction.normalized() * impulse, body.position)
+            if self.check_collide and impulse > MIN_DAMAGE_IMPULSE:
+                if shape.collision_type == COLLISION_PIG:
+                    self.handle_pig_collide(shape, impulse)
+                else:
+                    self.handle_block_collide(shape, impulse)
+        if self.stats is not None:
+            self.stats.explosion_time += time.perf_counter() - start
+
+    def get_settled_state(self):
+        '''pymunk x, y and angle of the bodies of the pigs and blocks, in the
+           order they were added'''
+        return {'pigs': [list(pig.phy.body.position) + [pig.phy.body.angle] for pig in self.pigs],
+                'blocks': [list(block.phy.body.position) + [block.phy.body.angle]
+                           for block in self.blocks]}
+
+    def set_settled_state(self, settled_data):
+        '''move the pigs and blocks just added to their resting state from
+           get_settled_state and let them sleep until something hits them.
+           They sleep in one group, there are no contacts yet to wake the
+           bodies resting on one that is hit or removed'''
+        entities = list(self.pigs) + list(self.blocks)
+        states = settled_data['pigs'] + settled_data['blocks']
+        if len(entities) != len(states):
             return
-
-        if self.explode_timer == 0:
-            self.explode_timer = self.current_time
-        elif (self.current_time - self.explode_timer) > 1000:
-            for explode in self.explodes:
-                self.space.remove(explode.shape, explode.shape.body)
-                self.explodes.remove(explode)
-                self.explode_timer = 0
-
-        for explode in self.explodes:
-            if explode.is_out_of_length():
-                explodes_to_remove.append(explode)
-
-        for explode in explodes_to_remove:
-            self.space.remove(explode.shape, explode.shape.body)
-            self.explodes.remove(explode)
+        for entity, (x, y, angle) in zip(entities, states):
+            body = entity.phy.body
+            body.position = x, y
+            body.angle = angle
+            body.velocity = 0, 0
+            body.angular_velocity = 0
+            self.space.reindex_shapes_for_body(body)
+        if self.sleep_time_threshold is not None and entities:
+            group = entities[0].phy.body
+            group.sleep()
+            for entity in entities[1:]:
+                entity.phy.body.sleep_with_group(group)
+        self.bodies.dirty = True
+
+    def snapshot(self):
+        '''branch the world: the space is pickled with its bodies, shapes and
+           cached contacts like Space.copy does and the entities keep a
+           shallow copy of their attributes'''
+        entities = list(self.shape_entities.items())
+        objects = (self.space, self.static_lines,
+                   [shape for shape, entity in entities])
+        data = io.BytesIO()
+        SpacePickler(data, self).dump(objects)
+        snapshot = {'data': data.getvalue(),
+                'entities': [(entity, get_entity_state(entity)) for shape, entity in entities],
+                'birds': list(self.birds),
+                'pigs': list(self.pigs),
+                'blocks': list(self.blocks),
+                'eggs': list(self.eggs),
+                'check_collide': self.check_collide,
+                'broadphase': self.broadphase,
+                'thinnest': self.thinnest,
+                'last_time': self.last_time,
+                'accumulator': self.accumulator}
+        # a copied space does not step bit for bit like the original one, so
+        # carry on with a copy to get the same result from every branch
+        self.restore(snapshot)
+        return snapshot
+
+    def restore(self, snapshot):
+        '''roll the world back to a snapshot, a snapshot can be restored any
+           number of times'''
+        data = io.BytesIO(snapshot['data'])
+        self.space, self.static_lines, shapes = SpaceUnpickler(data, self).load()
+        self.shape_entities = {}
+        for shape, (entity, state) in zip(shapes, snapshot['entities']):
+            set_entity_state(entity, state)
+            entity.phy.shape = shape
+            entity.phy.body = shape.body
+            self.shape_entities[shape] = entity
+        self.bodies = BodyArray()
+        self.birds = EntityList(snapshot['birds'])
+        self.pigs = EntityList(snapshot['pigs'])
+        self.blocks = EntityList(snapshot['blocks'])
+        self.eggs = EntityList(snapshot['eggs'])
+        self.check_collide = snapshot['check_collide']
+        # the spatial index is not pickled with the space
+        self.broadphase = snapshot['broadphase']
+        self.thinnest = snapshot['thinnest']
+        if self.broadphase is not None:
+            self.space.use_spatial_hash(*self.broadphase)
+        self.last_time = snapshot['last_time']
+        self.accumulator = snapshot['accumulator']
 
     def update(self, game_info, level, mouse_pressed):
-        birds_to_remove = []
-        pigs_to_remove = []
-        blocks_to_remove = []
-        eggs_to_remove = []
         self.current_time = game_info[c.CURRENT_TIME]
 
-        #From pymunk doc:Performing multiple calls with a smaller dt
-        #                creates a more stable and accurate simulation
-        #So make five updates per frame for better stability
-        for x in range(5):
-            self.space.step(self.dt)
+        # the real time passed is consumed in fixed steps of dt, split into
+        # more and smaller steps when a fast body could tunnel a thin one
+        steps = self.get_step_num()
+        substeps = self.get_substeps(steps)
+        dt = self.dt if substeps == steps else self.dt * steps / substeps
+        frame_stats = self.stats
+        if frame_stats is not None:
+            start = time.perf_counter()
+        for x in range(substeps):
+            if x == substeps - 1:
+                self.save_previous_state()
+            self.space.step(dt)
+        if frame_stats is not None:
+            frame_stats.step_time += time.perf_counter() - start
+
+        self.bodies.refresh(self.space, self.shape_entities)
 
         for bird in self.birds:
             bird.update(game_info, level, mouse_pressed)
-            if (bird.phy.shape.body.position.y < 0 or bird.state == c.DEAD
-                or bird.phy.shape.body.position.x > c.SCREEN_WIDTH * 2):
-                birds_to_remove.append(bird)
-            else:
-                poly = bird.phy.shape
-                # the postion transferred from pymunk is the center position of pygame
-                p = to_pygame(poly.body.position)
-                x, y = p
-                w, h = bird.image.get_size()
-                # change to [left, top] position of pygame
-                x -= w * 0.5
-                y -= h * 0.5
-                angle_degree = math.degrees(poly.body.angle)
-                bird.update_position(x, y, angle_degree)
-                self.update_bird_path(bird, p, level)
-
-        for bird in birds_to_remove:
-            self.space.remove(bird.phy.shape, bird.phy.shape.body)
-            self.birds.remove(bird)
-            bird.set_dead()
+            if bird.state == c.DEAD:
+                self.remove_bird(bird)
 
         for pig in self.pigs:
-            pig.update(game_info)
-            if pig.phy.body.position.y < 0 or pig.life <= 0:
-                pigs_to_remove.append(pig)
-            poly = pig.phy.shape
-            p = to_pygame(poly.body.position)
-            x, y = p
-            w, h = pig.image.get_size()
-            x -= w * 0.5
-            y -= h * 0.5
-            angle_degree = math.degrees(poly.body.angle)
-            pig.update_position(x, y, angle_degree)
-
-        for pig in pigs_to_remove:
-            self.space.remove(pig.phy.shape, pig.phy.shape.body)
-            self.pigs.remove(pig)
-            level.update_score(c.PIG_SCORE)
-
-        for block in self.blocks:
-            if block.life <= 0:
-                blocks_to_remove.append(block)
-            poly = block.phy.shape
-            p = poly.body.position
-            p = Vec2d(*to_pygame(p))
-            angle_degree = math.degrees(poly.body.angle) + 180
-            rotated_image = pg.transform.rotate(block.orig_image, angle_degree)
-            offset = Vec2d(*rotated_image.get_size()) / 2.
-            p = p - offset
-            block.update_position(p.x, p.y, rotated_image)
-
-        for block in blocks_to_remove:
-            self.space.remove(block.phy.shape, block.phy.shape.body)
-            self.blocks.remove(block)
-            level.update_score(c.SHAPE_SCORE)
+            pig.update(game_info, self.headless)
 
         for egg in self.eggs:
             egg.update(game_info, level, mouse_pressed)
             if egg.state == c.DEAD:
-                eggs_to_remove.append(egg)
-            poly = egg.phy.shape
-            p = to_pygame(poly.body.position)
-            x, y = p
-            w, h = egg.image.get_size()
-            # change to [left, top] position of pygame
-            x -= w * 0.5
-            y -= h * 0.5
-            angle_degree = math.degrees(poly.body.angle)
-            egg.update_position(x, y, angle_degree)
-
-        for egg in eggs_to_remove:
-            self.space.remove(egg.phy.shape, egg.phy.shape.body)
-            self.eggs.remove(egg)
-
-        self.check_explosion()
+                self.remove_entity(egg)
+                self.eggs.remove(egg)
+
+        self.apply_damage()
+        for entity in self.bodies.get_removed():
+            if entity.phy.shape.collision_type == COLLISION_BIRD:
+                self.remove_bird(entity)
+            elif entity.phy.shape.collision_type == COLLISION_PIG:
+                self.remove_entity(entity)
+                self.pigs.remove(entity)
+                level.update_score(c.PIG_SCORE)
+            else:
+                self.remove_entity(entity)
+                self.blocks.remove(entity)
+                level.update_score(c.SHAPE_SCORE)
+
+        if frame_stats is not None:
+            start = time.perf_counter()
+        rows, draw = self.bodies.get_moved(self.alpha, self.headless)
+        row_entities = self.bodies.entities
+        for i, (x, y, angle_degree) in zip(rows, draw):
+            entity = row_entities[i]
+            if entity.phy.shape not in self.shape_entities:
+                continue
+            collision_type = entity.phy.shape.collision_type
+            if collision_type == COLLISION_BLOCK:
+                rotated_image = tool.get_rotated_image(entity.orig_image, angle_degree + 180)
+                w, h = rotated_image.get_size()
+                entity.update_position(x - w / 2, y - h / 2, rotated_image)
+            else:
+                # the postion transferred from pymunk is the center position of pygame
+                w, h = entity.image.get_size()
+                # change to [left, top] position of pygame
+                entity.update_position(x - w * 0.5, y - h * 0.5, angle_degree)
+                if collision_type == COLLISION_BIRD:
+                    self.update_bird_path(entity, (int(x), int(y)), level)
+        if frame_stats is not None:
+            frame_stats.sync_time += time.perf_counter() - start
+
+        # the removed entities are freed after the whole frame is updated
+        for entities in (self.birds, self.pigs, self.blocks, self.eggs):
+            entities.flush()
+        if self.events.sinks:
+            self.events.drain()
+        if frame_stats is not None:
+            frame_stats.end_frame(len(self.bodies.entities), self.bodies.get_arbiter_num(self.space))
+
+    def remove_bird(self, bird):
+        if bird.phy.shape in self.shape_entities:
+            self.remove_entity(bird)
+            self.birds.remove(bird)
+            bird.set_dead()
+
+    def get_step_num(self):
+        '''fixed timestep: the real time passed since the last frame is added
+           to the accumulator and consumed in steps of step_time'''
+        if self.last_time is None:
+            elapsed = FRAME_TIME
+        else:
+            elapsed = self.current_time - self.last_time
+        self.last_time = self.current_time
+
+        self.accumulator += elapsed
+        # the small tolerance keeps a frame of exactly FRAME_TIME at substeps steps
+        steps = int(self.accumulator / self.step_time + 1e-6)
+        max_steps = self.substeps * MAX_CATCHUP_FRAMES
+        if steps > max_steps:
+            # the host is too slow to catch up, drop the time that is left
+            steps = max_steps
+            self.accumulator = steps * self.step_time
+        self.accumulator = max(0, self.accumulator - steps * self.step_time)
+        self.alpha = self.accumulator / self.step_time
+        return steps
+
+    def get_substeps(self, steps):
+        '''number of space steps to simulate steps steps of dt, at least
+           steps unless all bodies sleep'''
+        if steps == 0:
+            return 0
+        speed = self.bodies.get_max_speed(self.space)
+        # nothing moves when all bodies sleep: the contacts of sleeping
+        # bodies are not active. Fewer steps for bodies that are only idle
+        # would make stacks jitter and never fall asleep
+        if (speed < self.idle_speed_threshold and not self.bodies.dirty
+                and self.bodies.get_arbiter_num(self.space) == 0):
+            return 1
+        if self.thinnest == math.inf:
+            return steps
+        substeps = math.ceil(steps * self.dt * speed / (self.thinnest * TUNNEL_FRACTION))
+        return max(steps, min(substeps, steps * SUBSTEP_SCALE))
+
+    def save_previous_state(self):
+        '''keep the state before the last step of the frame, the sprites are
+           drawn between it and the current state'''
+        if self.headless:
+            return
+        self.bodies.save_previous(self.space)
 
     def update_bird_path(self, bird, pos, level):
         if bird.path_timer == 0:
@@ -317,40 +799,60 @@ class Physics():
                 level.bird_path.append(pos)
 
     def handle_bird_collide(self, bird_shape, is_ground=False):
-        for bird in self.birds:
-            if bird_shape == bird.phy.shape:
-                if is_ground: # change the velocity of bird to 50% of the original value
-                    if not (bird.name == c.BIG_RED_BIRD and bird.jump):
-                        bird.phy.body.velocity = bird.phy.body.velocity * 0.5
-                elif bird.name == c.BIG_RED_BIRD:
-                    bird.jump = False
-                bird.set_collide()
-
-    def handle_pig_collide(self, pig_shape, impulse, is_ground=False):
-        for pig in self.pigs:
-            if pig_shape == pig.phy.shape:
-                if is_ground:
-                    pig.phy.body.velocity = pig.phy.body.velocity * 0.8
-                else:
-                    damage = impulse // MIN_DAMAGE_IMPULSE
-                    pig.set_damage(damage)
-                    print('pig life:', pig.life, ' damage:', damage, ' impulse:', impulse)
+        bird = self.shape_entities.get(bird_shape)
+        if bird is None:
+            return
+        if is_ground: # change the velocity of bird to 50% of the original value
+            if not (bird.name == c.BIG_RED_BIRD and bird.jump):
+                bird.phy.body.velocity = bird.phy.body.velocity * 0.5
+        elif bird.name == c.BIG_RED_BIRD:
+            bird.jump = False
+        bird.set_collide()
+
+    def handle_pig_collide(self, pig_shape, impulse, is_ground=False, other_type=0):
+        if is_ground:
+            pig = self.shape_entities.get(pig_shape)
+            if pig is not None:
+                pig.phy.body.velocity = pig.phy.body.velocity * 0.8
+        else:
+            self.damage_records.append((pig_shape, impulse, other_type))
+
+    def handle_block_collide(self, block_shape, impulse, other_type=0):
+        self.damage_records.append((block_shape, impulse, other_type))
 
-    def handle_block_collide(self, block_shape, impulse):
-        for block in self.blocks:
-            if block_shape == block.phy.shape:
-                damage = impulse // MIN_DAMAGE_IMPULSE
-                block.set_damage(damage)
-                print('block damage:', damage, ' impulse:', impulse, ' life:', block.life)
+    def apply_damage(self):
+        '''resolve the damage recorded by the collision handlers during the
+           steps and by the explosions of the frame in one pass, in the order
+           of the records. Each entity is damaged once with its total'''
+        if not self.damage_records:
+            return
+        damages = {}
+        for shape, impulse, other_type in self.damage_records:
+            entity = self.shape_entities.get(shape)
+            if entity is None:
+                continue
+            damage = impulse // MIN_DAMAGE_IMPULSE
+            total = damages.get(entity, 0) + damage
+            damages[entity] = total
+            if shape.collision_type == COLLISION_PIG:
+                kind = events.EVENT_PIG_DAMAGE
+            else:
+                kind = events.EVENT_BLOCK_DAMAGE
+            self.events.record(kind, shape.collision_type, other_type, entity,
+                               impulse, damage, entity.life - total)
+        self.damage_records = []
+        for entity, damage in damages.items():
+            entity.set_damage(damage)
+            self.bodies.set_life(entity)
 
     def handle_egg_collide(self, egg_shape):
-        for egg in self.eggs:
-            if egg_shape == egg.phy.shape:
-                egg.set_explode()
-                egg.phy.body.velocity = egg.phy.body.velocity * 0.01
-                break
+        egg = self.shape_entities.get(egg_shape)
+        if egg is None:
+            return
+        egg.set_explode()
+        egg.phy.body.velocity = egg.phy.body.velocity * 0.01
 
-    def draw(self, surface):
+    def draw_debug(self, surface):
         # Draw static lines
         if c.DEBUG:
             for line in self.static_lines:
@@ -361,22 +863,22 @@ class Physics():
                 p2 = to_pygame(pv2)
                 pg.draw.lines(surface, c.RED, False, [p1, p2])
 
-        for bird in self.birds:
-            bird.draw(surface)
-
-        for pig in self.pigs:
-            pig.draw(surface)
-
-        for block in self.blocks:
-            block.draw(surface)
-
-        for egg in self.eggs:
-            egg.draw(surface)
-
-        if c.DEBUG:
-            for explode in self.explodes:
-                pos = to_pygame(explode.body.position)
-                pg.draw.circle(surface, c.RED, pos, 5)
+@functools.lru_cache(maxsize=256)
+def get_trajectory(distance, angle, mass, x, y):
+    '''pygame positions of the launch arc of a bird added with the same
+       values by Physics.add_bird, evaluated in closed form without stepping
+       a space. The arc stops at the ground or the right side of the screen'''
+    x, y = to_pymunk(x, y)
+    impulse = distance * LAUNCH_POWER * Vec2d(1, 0)
+    vx, vy = impulse.rotated(-angle) / mass
+    points = []
+    for i in range(1, PREVIEW_POINT_NUM + 1):
+        t = i * PREVIEW_TIME
+        pos = to_pygame(Vec2d(x + vx * t, y + vy * t + 0.5 * GRAVITY * t * t))
+        if pos[0] > c.SCREEN_WIDTH or pos[1] > c.GROUND_HEIGHT:
+            break
+        points.append(pos)
+    return tuple(points)
 
 class PhyBird():
     def __init__(self, distance, angle, x, y, space, radius, mass):
@@ -384,7 +886,7 @@ class PhyBird():
         inertia = pm.moment_for_circle(mass, 0, radius, (0, 0))
         body = pm.Body(mass, inertia)
         body.position = x, y
-        power = distance * 53
+        power = distance * LAUNCH_POWER
         impulse = power * Vec2d(1, 0)
         angle = -angle
         body.apply_impulse_at_local_point(impulse.rotated(angle))
@@ -451,36 +953,6 @@ class PhyCircle():
         self.body = body
         self.shape = shape
 
-class PhyExplode():
-    def __init__(self, pos, angle, length, space, mass=5.0):
-        ''' parater angle is clockwise value '''
-        radius = 3
-        moment = 1000
-        body = pm.Body(mass, moment)
-        body.position = Vec2d(*pos)
-
-        power = mass * 2000
-        impulse = power * Vec2d(0, 1)
-        # the angle of rotated function is counter-clockwise, need to reverse it
-        angle = -angle
-        body.apply_impulse_at_local_point(impulse.rotated(angle))
-
-        shape = pm.Circle(body, radius, (0, 0))
-        shape.friction = 1
-        shape.collision_type = COLLISION_EXPLODE
-        space.add(body, shape)
-        self.body = body
-        self.shape = shape
-        self.orig_pos = pos
-        self.length = length
-
-    def is_out_of_length(self):
-        pos = self.body.position
-        distance = tool.distance(*pos, *self.orig_pos)
-        if distance >= self.length:
-            return True
-        return False
-
 class PhyEgg():
     def __init__(self, pos, length, height, space, mass=5.0):
         moment = 1000
@@ -497,6 +969,3 @@ class PhyEgg():
         space.add(body, shape)
         self.body = body
         self.shape = shape
-
-# must init as a global parameter to use in the post_solve handler
-my_phy = Physics()
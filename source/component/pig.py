@@ -1,7 +1,6 @@
 __author__ = 'marble_xu'
 
 import random
-import pygame as pg
 from .. import tool
 from .. import constants as c
 
@@ -54,11 +53,11 @@ class Pig():
             temp_life = self.life//self.image_num * i
             self.image_threshold.append(temp_life)
         
-    def update(self, game_info):
+    def update(self, game_info, headless=False):
         self.current_time = game_info[c.CURRENT_TIME]
-        self.animation()
+        self.animation(headless)
 
-    def animation(self):
+    def animation(self, headless=False):
         if self.frame_index == 0:
             interval = 2000 + random.randint(0, 2000)
         else:
@@ -71,7 +70,10 @@ class Pig():
             self.animate_timer = self.current_time
 
         image = self.frames[self.frame_index]
-        self.image = pg.transform.rotate(image, self.angle_degree)
+        if headless:
+            self.image = image
+        else:
+            self.image = tool.get_rotated_image(image, self.angle_degree)
 
     def set_physics(self, phy):
         self.phy = phy
@@ -0,0 +1,93 @@
+'''Per-frame instrumentation of the physics.
+
+When Physics is created with record_stats=True, each update records:
+- the time spent in space.step over all steps of the frame;
+- the number of Python collision callbacks;
+- the time spent syncing the sprites;
+- the time spent in create_explosion;
+- the live body and contact counts.
+
+Each value goes into a fixed-size histogram, so memory does not grow with
+the frames. The default Physics has no stats object: the collision
+handlers are registered unwrapped and update only tests one attribute
+against None.
+'''
+
+import json
+import numpy as np
+
+STAT_STEP_TIME = 'step_ms'
+STAT_CALLBACKS = 'callbacks'
+STAT_SYNC_TIME = 'sync_ms'
+STAT_EXPLOSION_TIME = 'explosion_ms'
+STAT_BODIES = 'bodies'
+STAT_CONTACTS = 'contacts'
+
+# ten bins per decade from 1 microsecond to 10 seconds for the times and
+# powers of two up to 65536 for the counts, values outside the edges are
+# counted in the first or last bin
+TIME_EDGES = np.geomspace(0.001, 10000, 71)
+COUNT_EDGES = np.concatenate(([0], 2.0 ** np.arange(17)))
+STAT_EDGES = {
+    STAT_STEP_TIME: TIME_EDGES,
+    STAT_CALLBACKS: COUNT_EDGES,
+    STAT_SYNC_TIME: TIME_EDGES,
+    STAT_EXPLOSION_TIME: TIME_EDGES,
+    STAT_BODIES: COUNT_EDGES,
+    STAT_CONTACTS: COUNT_EDGES,
+}
+
+class Histogram():
+    def __init__(self, edges):
+        self.edges = edges
+        self.counts = np.zeros(len(edges) - 1, np.int64)
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        i = int(np.searchsorted(self.edges, value, 'right')) - 1
+        self.counts[min(max(i, 0), len(self.counts) - 1)] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def get_summary(self, frames):
+        return {'mean': self.total / frames if frames else 0,
+                'max': self.max,
+                'total': self.total,
+                'edges': self.edges.tolist(),
+                'counts': self.counts.tolist()}
+
+class FrameStats():
+    '''Physics adds to the values of the current frame and calls end_frame
+       once at the end of update'''
+    def __init__(self):
+        self.histograms = {name: Histogram(edges) for name, edges in STAT_EDGES.items()}
+        self.frames = 0
+        self.clear_frame()
+
+    def clear_frame(self):
+        self.step_time = 0
+        self.callback_num = 0
+        self.sync_time = 0
+        self.explosion_time = 0
+
+    def end_frame(self, body_num, contact_num):
+        histograms = self.histograms
+        histograms[STAT_STEP_TIME].add(self.step_time * 1000)
+        histograms[STAT_CALLBACKS].add(self.callback_num)
+        histograms[STAT_SYNC_TIME].add(self.sync_time * 1000)
+        histograms[STAT_EXPLOSION_TIME].add(self.explosion_time * 1000)
+        histograms[STAT_BODIES].add(body_num)
+        histograms[STAT_CONTACTS].add(contact_num)
+        self.frames += 1
+        self.clear_frame()
+
+    def get_summary(self):
+        return {'frames': self.frames,
+                'stats': {name: histogram.get_summary(self.frames)
+                          for name, histogram in self.histograms.items()}}
+
+    def save(self, file_path):
+        f = open(file_path, 'w')
+        json.dump(self.get_summary(), f)
+        f.close()
@@ -1,6 +1,22 @@
 __author__ = 'marble_xu'
 
 DEBUG = False
+# write a recording of every played level to RECORD_DIR, see source.replay
+RECORD = False
+RECORD_DIR = 'recordings'
+# write the per-frame physics stats of every played level to STATS_DIR
+STATS = False
+STATS_DIR = 'stats'
+
+# sprites are rotated in steps of ROTATE_ANGLE_STEP degrees, the rotated
+# images are cached in an LRU cache of ROTATE_CACHE_SIZE images
+ROTATE_ANGLE_STEP = 1
+ROTATE_CACHE_SIZE = 2048
+
+# redraw and push only the changed parts of the screen, see tool.DirtyRenderer
+DIRTY_RECTS = False
+# the whole screen is drawn when the changed area is larger than this part
+DIRTY_MAX_AREA = 0.5
 
 START_LEVEL_NUM = 1
 
@@ -68,6 +84,12 @@ DIRECTION = 'direction'
 BIRDS = 'birds'
 PIGS = 'pigs'
 BLOCKS = 'blocks'
+BROADPHASE = 'broadphase'
+BROADPHASE_TREE = 'tree'
+BROADPHASE_HASH = 'hash'
+SOLVER = 'solver'
+THREADS = 'threads'
+ITERATIONS = 'iterations'
 
 #BIRD
 BIRD_SHEET = 'angry_birds'
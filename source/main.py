@@ -6,6 +6,7 @@ from . import constants as c
 from .state import level
 
 def main():
+    tool.setup_display()
     game = tool.Control()
     state_dict = {c.LEVEL: level.Level()}
     game.setup_states(state_dict, c.LEVEL)
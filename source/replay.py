@@ -0,0 +1,139 @@
+'''Deterministic shot recording and replay.
+
+A recording holds what decides a played level: the level, the seed of the
+random module, the profile and threads of the physics, the time of every
+frame, the sling values and frame of every shot and the frames the mouse
+was pressed on, which trigger the special abilities. It ends with the
+outcome of the level: the pigs, blocks and birds left and a digest of the
+state of all bodies.
+
+The replayer runs a recording in a headless Simulation at full speed, the
+outcome must match the recorded one byte for byte. A folder of recordings
+is a corpus to check physics changes against.
+
+Run from the project root: python -m source.replay FILE_OR_FOLDER ...
+'''
+
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+from . import simulation
+
+VERSION = 1
+
+def get_outcome(physics, birds):
+    '''pigs, blocks and birds left and a digest of the position, angle,
+       velocity of all bodies and the life of the pigs and blocks'''
+    ids, state = physics.bodies.fetch(physics.space)
+    digest = hashlib.sha1(state.tobytes())
+    life = [entity.life for entities in (physics.pigs, physics.blocks) for entity in entities]
+    digest.update(np.array(life, np.float64).tobytes())
+    return {'pigs': len(physics.pigs),
+            'blocks': len(physics.blocks),
+            'birds': len(birds) + len(physics.birds),
+            'digest': digest.hexdigest()}
+
+class Recorder():
+    '''Level calls record_frame at the start of every frame, record_shot when
+       a bird is released and finish when the level is over'''
+    def __init__(self, level_num, seed, physics):
+        self.data = {'version': VERSION,
+                     'level': level_num,
+                     'seed': seed,
+                     'profile': physics.profile_name,
+                     'threads': physics.solver[0],
+                     'start': None,
+                     # run length coded [time between frames, frames]
+                     'times': [],
+                     # [frame, distance, angle]
+                     'shots': [],
+                     # [first frame, last frame + 1] of each mouse press
+                     'presses': [],
+                     'outcome': None}
+        self.frame = -1
+        self.last_time = None
+
+    def record_frame(self, current_time, mouse_pressed):
+        self.frame += 1
+        if self.last_time is None:
+            self.data['start'] = current_time
+        else:
+            elapsed = current_time - self.last_time
+            times = self.data['times']
+            if times and times[-1][0] == elapsed:
+                times[-1][1] += 1
+            else:
+                times.append([elapsed, 1])
+        self.last_time = current_time
+
+        if mouse_pressed:
+            presses = self.data['presses']
+            if presses and presses[-1][1] == self.frame:
+                presses[-1][1] += 1
+            else:
+                presses.append([self.frame, self.frame + 1])
+
+    def record_shot(self, distance, angle):
+        self.data['shots'].append([self.frame, distance, angle])
+
+    def finish(self, physics, birds):
+        self.data['outcome'] = get_outcome(physics, birds)
+
+    def save(self, file_path):
+        f = open(file_path, 'w')
+        json.dump(self.data, f, separators=(',', ':'))
+        f.close()
+
+def load_recording(file_path):
+    f = open(file_path)
+    recording = json.load(f)
+    f.close()
+    return recording
+
+def get_frame_times(recording):
+    current_time = recording['start']
+    yield current_time
+    for elapsed, frames in recording['times']:
+        for i in range(frames):
+            current_time += elapsed
+            yield current_time
+
+def replay(recording):
+    '''run a recording headless and return its outcome'''
+    sim = simulation.Simulation(recording['level'], profile=recording['profile'],
+                                threads=recording['threads'], seed=recording['seed'])
+    shots = {frame: (distance, angle) for frame, distance, angle in recording['shots']}
+    pressed = set()
+    for start, end in recording['presses']:
+        pressed.update(range(start, end))
+    for frame, current_time in enumerate(get_frame_times(recording)):
+        if frame in shots:
+            sim.launch(*shots[frame])
+        sim.step(frame in pressed, current_time)
+    return get_outcome(sim.physics, sim.birds)
+
+def get_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.json'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def main():
+    failed = 0
+    for file_path in get_files(sys.argv[1:]):
+        recording = load_recording(file_path)
+        outcome = replay(recording)
+        if outcome == recording['outcome']:
+            print('%s: ok' % file_path)
+        else:
+            failed += 1
+            print('%s: expected %s, got %s' % (file_path, recording['outcome'], outcome))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
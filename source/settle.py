@@ -0,0 +1,97 @@
+'''Settled level cache: simulate the pigs and blocks of each level until they
+come to rest and store their resting state next to the map file.
+
+Level and Simulation load the cache after adding the pigs and blocks, so a
+level starts at rest instead of spending its first frames settling. The
+cache keeps a hash of the pigs and blocks of the map and is ignored once
+they change, run this again after editing a map. Each level is then loaded
+from the cache and a block that holds up other bodies is removed, to check
+that the bodies above it wake up and fall.
+
+Run from the project root: python -m source.settle [LEVEL ...]
+'''
+
+import json
+import os
+import sys
+from . import tool
+from . import simulation
+from .component import physics
+
+# give up on a level that does not come to rest in 20 seconds of game time
+MAX_SETTLE_FRAMES = 1200
+# frames to step after removing a support block and the fall in pixels
+# expected from the bodies above it
+CHECK_FRAMES = 60
+MIN_FALL = 5
+
+def is_at_rest(sim):
+    return all(entity.phy.body.is_sleeping
+               for entities in (sim.physics.pigs, sim.physics.blocks)
+               for entity in entities)
+
+def settle(level_num):
+    '''step the level from its map positions with the profile of the game,
+       return the settled data and the number of frames it took'''
+    sim = simulation.Simulation(level_num, profile=physics.PROFILE_INTERACTIVE, settled=False)
+    while not is_at_rest(sim) and sim.frame < MAX_SETTLE_FRAMES:
+        sim.step()
+    settled_data = sim.physics.get_settled_state()
+    settled_data['hash'] = tool.get_layout_hash(sim.map_data)
+    return settled_data, sim.frame
+
+def get_support(sim):
+    '''the block with the most bodies above it and those bodies'''
+    entities = list(sim.physics.pigs) + list(sim.physics.blocks)
+    support, above = None, []
+    for tmp in sim.physics.blocks:
+        bb = tmp.phy.shape.bb
+        bodies = [entity for entity in entities if entity is not tmp and
+                  bb.left < entity.phy.body.position.x < bb.right and
+                  entity.phy.body.position.y > bb.top]
+        if len(bodies) > len(above):
+            support, above = tmp, bodies
+    return support, above
+
+def check_support(level_num):
+    '''remove a support block of the settled level and return the largest
+       fall of the bodies above it, None if no block holds up another body'''
+    sim = simulation.Simulation(level_num, profile=physics.PROFILE_INTERACTIVE)
+    support, above = get_support(sim)
+    if support is None:
+        return None
+    start = [entity.phy.body.position.y for entity in above]
+    # the impulse that takes all the life of the block
+    sim.physics.handle_block_collide(support.phy.shape, support.life * physics.MIN_DAMAGE_IMPULSE)
+    for i in range(CHECK_FRAMES):
+        sim.step()
+    return max(y - entity.phy.body.position.y for y, entity in zip(start, above))
+
+def write_settled_data(level_num, settled_data):
+    f = open(tool.get_settled_path(level_num), 'w')
+    json.dump(settled_data, f)
+    f.close()
+
+def get_levels():
+    levels = []
+    for map_file in os.listdir(os.path.join('source', 'data', 'map')):
+        name, ext = os.path.splitext(map_file)
+        if ext == '.json' and name.startswith('level_') and name[6:].isdigit():
+            levels.append(int(name[6:]))
+    return sorted(levels)
+
+def main():
+    levels = [int(arg) for arg in sys.argv[1:]] or get_levels()
+    for level_num in levels:
+        settled_data, frames = settle(level_num)
+        write_settled_data(level_num, settled_data)
+        if frames >= MAX_SETTLE_FRAMES:
+            print('level %d: not at rest after %d frames' % (level_num, frames))
+        else:
+            print('level %d: at rest after %d frames' % (level_num, frames))
+        fall = check_support(level_num)
+        if fall is not None and fall < MIN_FALL:
+            print('level %d: the bodies above a removed block do not fall' % level_num)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+'''Headless simulation of a level.
+
+The pymunk space is built through the same Physics.add_* calls as the game,
+but no window is opened, no sprite is rotated or drawn and the frames are
+stepped as fast as the CPU allows instead of at Control.fps.
+'''
+
+import random
+from . import tool
+from . import constants as c
+from .component import physics, bird, pig, block
+
+# launch position of the bird, the same values Level uses on release
+LAUNCH_X = 154
+LAUNCH_Y = 444
+# give up a shot after 20 seconds of game time
+MAX_SHOT_FRAMES = 1200
+# frames to let the blocks fall after the last bird is gone
+SETTLE_FRAMES = 60
+
+class Simulation():
+    def __init__(self, level_num, bird_type=None, profile=physics.PROFILE_SOLVER, settled=True,
+                 threads=1, record_stats=False, seed=None):
+        '''bird_type replaces the type of the first bird of the level, profile
+           is the quality profile of the physics, see physics.PROFILES. Every
+           Simulation has its own Physics, stepped on one thread by default so
+           many of them can run side by side in one process or one per thread
+           and the steps are deterministic. With settled the level starts
+           from its cached resting state, see source.settle. record_stats is
+           passed to the Physics. The birds and pigs blink at random and the
+           blinks also time the explosions of black birds and eggs, seed
+           seeds the random module on reset like Level does'''
+        if not tool.GFX:
+            tool.setup_headless()
+        self.level_num = level_num
+        self.settled = settled
+        self.seed = seed
+        self.map_data = tool.load_map_data(level_num)
+        if bird_type is not None:
+            self.map_data[c.BIRDS][0][c.TYPE] = bird_type
+        self.game_info = {c.CURRENT_TIME:0,
+                          c.LEVEL_NUM:level_num,
+                          c.SCORE:0}
+        self.physics = physics.Physics(threads=threads, profile=profile,
+                                       record_stats=record_stats, headless=True)
+        self.reset()
+
+    def reset(self):
+        if self.seed is not None:
+            random.seed(self.seed)
+        self.score = 0
+        self.frame = 0
+        self.current_time = 0
+        self.game_info[c.CURRENT_TIME] = 0
+        self.victory = False
+        self.bird_path = []
+        self.physics.reset(self)
+        self.setup_birds()
+        self.setup_pigs()
+        self.setup_blocks()
+        if self.settled:
+            self.setup_settled()
+        self.physics.setup_broadphase(self.map_data.get(c.BROADPHASE))
+        self.pig_num = len(self.physics.pigs)
+        self.block_num = len(self.physics.blocks)
+
+    def setup_birds(self):
+        self.birds = []
+        for i, data in enumerate(self.map_data[c.BIRDS]):
+            tmp = bird.create_bird(data[c.TYPE], 120 - (i*35), c.GROUND_HEIGHT)
+            if tmp:
+                self.birds.append(tmp)
+
+    def setup_pigs(self):
+        for data in self.map_data[c.PIGS]:
+            tmp = pig.create_pig(data[c.TYPE], data['x'], data['y'])
+            if tmp:
+                self.physics.add_pig(tmp)
+
+    def setup_blocks(self):
+        for data in self.map_data[c.BLOCKS]:
+            direction = data.get(c.DIRECTION, 0)
+            tmp = block.create_block(data['x'], data['y'], data[c.MATERIAL],
+                              data[c.SHAPE], data[c.TYPE], direction)
+            if tmp:
+                self.physics.add_block(tmp)
+
+    def setup_settled(self):
+        settled_data = tool.load_settled_data(self.level_num, self.map_data)
+        if settled_data is not None:
+            self.physics.set_settled_state(settled_data)
+
+    def update_score(self, score):
+        self.score += score
+
+    def step(self, mouse_pressed=False, current_time=None):
+        '''current_time defaults to frames of physics.FRAME_TIME, the time
+           the accumulator of the physics takes as one frame. The birds
+           waiting for the sling are updated like Level does'''
+        self.frame += 1
+        if current_time is None:
+            current_time = self.frame * physics.FRAME_TIME
+        self.current_time = current_time
+        self.game_info[c.CURRENT_TIME] = self.current_time
+        for tmp in self.birds:
+            tmp.update(self.game_info, self, mouse_pressed)
+        self.physics.update(self.game_info, self, mouse_pressed)
+        if not self.victory and len(self.physics.pigs) == 0:
+            # the same bonus Level.check_game_state gives for the unused birds
+            self.victory = True
+            self.update_score(len(self.birds) * c.BIRD_SCORE)
+
+    def is_settled(self):
+        return len(self.physics.birds) == 0 and len(self.physics.eggs) == 0
+
+    def shoot(self, distance, angle, ability_frame=None, max_frames=MAX_SHOT_FRAMES):
+        '''launch the next bird with the sling values of Level and step until
+           it is gone, ability_frame is the frame after launch on which the
+           mouse click that triggers the special ability of the bird happens'''
+        if len(self.birds) == 0:
+            return self.get_result()
+        self.launch(distance, angle)
+
+        settle_timer = 0
+        for i in range(max_frames):
+            self.step(i == ability_frame)
+            if self.is_settled():
+                settle_timer += 1
+                if settle_timer > SETTLE_FRAMES:
+                    break
+        return self.get_result()
+
+    def launch(self, distance, angle):
+        '''release the next bird from the sling'''
+        active_bird = self.birds.pop(0)
+        self.physics.add_bird(active_bird, distance, angle, LAUNCH_X, LAUNCH_Y)
+        active_bird.set_attack()
+        self.physics.enable_check_collide()
+
+    def snapshot(self):
+        '''branch the current state of the level, see Physics.snapshot. The
+           state of the random module is part of it'''
+        return {'physics': self.physics.snapshot(),
+                'birds': [(tmp, physics.get_entity_state(tmp)) for tmp in self.birds],
+                'score': self.score,
+                'frame': self.frame,
+                'victory': self.victory,
+                'random': random.getstate()}
+
+    def restore(self, snapshot):
+        self.physics.restore(snapshot['physics'])
+        self.birds = []
+        for tmp, state in snapshot['birds']:
+            physics.set_entity_state(tmp, state)
+            self.birds.append(tmp)
+        self.score = snapshot['score']
+        self.frame = snapshot['frame']
+        self.victory = snapshot['victory']
+        random.setstate(snapshot['random'])
+        self.current_time = self.frame * physics.FRAME_TIME
+        self.game_info[c.CURRENT_TIME] = self.current_time
+        self.bird_path = []
+
+    def get_result(self):
+        return {'score': self.score,
+                'pigs_killed': self.pig_num - len(self.physics.pigs),
+                'blocks_destroyed': self.block_num - len(self.physics.blocks),
+                'frames': self.frame}
+
+def simulate_shot(level_num, distance, angle, ability_frame=None):
+    '''simulate the first bird of a level shot with the given sling values'''
+    sim = Simulation(level_num)
+    return sim.shoot(distance, angle, ability_frame)
@@ -0,0 +1,111 @@
+'''Aim solver: search the (angle, distance) sling values of a shot.
+
+Every candidate shot is run in a headless Simulation. The level is built
+and settled once per worker process, then each shot starts from a restored
+snapshot of it with the same state of the random module, so the results
+do not depend on the worker or the order the candidates run in. The frames
+of a result are counted from the end of the warmup.
+
+Run from the project root: python -m source.solver LEVEL [BIRD_TYPE]
+'''
+
+import multiprocessing
+import os
+import sys
+from . import simulation
+
+# the sling values Level passes to Physics.add_bird: a negative angle
+# points upwards and the distance is the pull of the rope, at most 100
+ANGLES = [x / 10 for x in range(-14, 7)]
+DISTANCES = [x for x in range(20, 101, 10)]
+# frames to let the level settle before the shot, the auto shot of Level
+# is released 3 seconds after the level starts
+WARMUP_FRAMES = 180
+# results that are refined with a finer grid around them
+REFINE_TOP = 5
+# seed of the random module in every worker
+SEED = 0
+
+worker_sim = None
+worker_snapshot = None
+
+def init_worker(level_num, bird_type, warmup):
+    global worker_sim, worker_snapshot
+    worker_sim = simulation.Simulation(level_num, bird_type, seed=SEED)
+    for i in range(warmup):
+        worker_sim.step()
+    worker_snapshot = worker_sim.snapshot()
+
+def evaluate(shot):
+    angle, distance, ability_frame = shot
+    worker_sim.restore(worker_snapshot)
+    result = worker_sim.shoot(distance, angle, ability_frame)
+    result['frames'] -= worker_snapshot['frame']
+    result['angle'] = angle
+    result['distance'] = distance
+    result['ability_frame'] = ability_frame
+    return result
+
+def rank_key(result):
+    return (result['pigs_killed'], result['score'], result['blocks_destroyed'])
+
+def get_grid(angles, distances, ability_frames):
+    return [(angle, distance, ability_frame) for angle in angles
+            for distance in distances for ability_frame in ability_frames]
+
+def get_refined_shots(results, angle_step, distance_step, ability_frames):
+    '''shots on a grid of half the step around the best results'''
+    shots = []
+    for result in results[:REFINE_TOP]:
+        for i in (-1, 0, 1):
+            for j in (-1, 0, 1):
+                angle = round(result['angle'] + i * angle_step, 4)
+                distance = min(100, result['distance'] + j * distance_step)
+                for ability_frame in ability_frames:
+                    shots.append((angle, distance, ability_frame))
+    return shots
+
+def solve(level_num, bird_type=None, angles=ANGLES, distances=DISTANCES,
+          ability_frames=(None,), refine=1, processes=None, warmup=WARMUP_FRAMES):
+    '''evaluate the grid of shots on a process pool, then refine it around
+       the best results refine times. Return the results sorted from the
+       best shot, ranked by pigs killed, score and blocks destroyed'''
+    angle_step = angles[1] - angles[0] if len(angles) > 1 else 0.1
+    distance_step = distances[1] - distances[0] if len(distances) > 1 else 10
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    pool = multiprocessing.Pool(processes, init_worker, (level_num, bird_type, warmup))
+    try:
+        shots = get_grid(angles, distances, ability_frames)
+        done = set()
+        results = []
+        for i in range(refine + 1):
+            shots = [shot for shot in dict.fromkeys(shots) if shot not in done]
+            done.update(shots)
+            chunksize = max(1, len(shots) // (processes * 4))
+            results += pool.map(evaluate, shots, chunksize)
+            results.sort(key=rank_key, reverse=True)
+            angle_step /= 2
+            distance_step /= 2
+            shots = get_refined_shots(results, angle_step, distance_step, ability_frames)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+def print_results(results, num=10):
+    print('angle  distance  ability  pigs  blocks  score')
+    for result in results[:num]:
+        ability_frame = result['ability_frame']
+        print('%5.2f  %8.1f  %7s  %4d  %6d  %5d' % (result['angle'], result['distance'],
+              '-' if ability_frame is None else ability_frame,
+              result['pigs_killed'], result['blocks_destroyed'], result['score']))
+
+def main():
+    level_num = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    bird_type = sys.argv[2] if len(sys.argv) > 2 else None
+    print_results(solve(level_num, bird_type))
+
+if __name__ == '__main__':
+    main()
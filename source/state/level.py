@@ -1,11 +1,13 @@
 __author__ = 'marble_xu'
 
 import os
-import json
 import math
+import random
+import functools
 import pygame as pg
 from .. import tool
 from .. import constants as c
+from .. import replay
 from ..component import button, physics, bird, pig, block
 
 import sys
@@ -14,6 +16,11 @@ import shot_calc
 
 bold_font = pg.font.SysFont("arial", 30, bold=True)
 
+# area of the ropes and the bird in the sling
+SLING_AREA = pg.Rect(20, 330, 260, 250)
+# the dots of a bird path are drawn again in groups of this many
+PATH_CHUNK = 12
+
 def vector(p0, p1):
     """Return the vector of the points
        p0 = (xo,yo), p1 = (x1,y1)"""
@@ -31,6 +38,18 @@ def unit_vector(v):
     ub = v[1] / h
     return (ua, ub)
 
+@functools.lru_cache(maxsize=None)
+def get_background():
+    '''the background scaled to the window, built once per process'''
+    background = tool.GFX['background']
+    rect = background.get_rect()
+    return pg.transform.scale(background, (int(rect.width*c.BACKGROUND_MULTIPLER),
+                                           int(rect.height*c.BACKGROUND_MULTIPLER)))
+
+def get_sprite_item(sprite):
+    rect = pg.Rect(sprite.rect.topleft, sprite.image.get_size())
+    return (sprite, rect, sprite.image, sprite.draw)
+
 class Level(tool.State):
     def __init__(self):
         tool.State.__init__(self)
@@ -40,6 +59,7 @@ class Level(tool.State):
         self.game_info = persist
         self.persist = self.game_info
         self.game_info[c.CURRENT_TIME] = current_time
+        self.physics = physics.Physics(record_stats=c.STATS)
         self.reset()
         # Auto-shot timings (milliseconds). Activate at +2000ms, release at +3000ms
         self.auto_shot_activate_at = current_time + 2000
@@ -50,30 +70,33 @@ class Level(tool.State):
     def reset(self):
         self.score = self.game_info[c.SCORE]
         self.state = c.IDLE
-        self.physics = physics.my_phy
-        self.physics.reset(self)
+        self.level_num = self.game_info[c.LEVEL_NUM]
+        # the birds and pigs blink at random, a recording replays the seed
+        self.seed = random.randrange(2**32)
+        random.seed(self.seed)
         self.load_map()
+        self.physics.reset(self)
         self.setup_background()
         self.setup_buttons()
         self.setup_sling()
         self.setup_birds()
         self.setup_pigs()
         self.setup_blocks()
+        self.setup_settled()
+        self.physics.setup_broadphase(self.map_data.get(c.BROADPHASE))
+        self.setup_score()
+        self.setup_static_layer()
+        self.renderer = tool.DirtyRenderer()
         self.over_timer = 0
+        self.recorder = None
+        if c.RECORD:
+            self.recorder = replay.Recorder(self.level_num, self.seed, self.physics)
 
     def load_map(self):
-        map_file = 'level_' + str(self.game_info[c.LEVEL_NUM]) + '.json'
-        file_path = os.path.join('source', 'data', 'map', map_file)
-        f = open(file_path)
-        self.map_data = json.load(f)
-        f.close()
+        self.map_data = tool.load_map_data(self.game_info[c.LEVEL_NUM])
 
     def setup_background(self):
-        self.background = tool.GFX['background']
-        self.bg_rect = self.background.get_rect()
-        self.background = pg.transform.scale(self.background, 
-                                    (int(self.bg_rect.width*c.BACKGROUND_MULTIPLER),
-                                    int(self.bg_rect.height*c.BACKGROUND_MULTIPLER)))
+        self.background = get_background()
         self.bg_rect = self.background.get_rect()
         self.bg_rect.y = -40
 
@@ -82,6 +105,23 @@ class Level(tool.State):
         self.buttons.append(button.Button(5, c.BUTTON_HEIGHT, c.NEXT_BUTTON))
         self.buttons.append(button.Button(70, c.BUTTON_HEIGHT, c.REPLAY_BUTTON))
 
+    def setup_score(self):
+        self.score_label = bold_font.render("SCORE:", 1, c.WHITE)
+        self.score_image = None
+        self.score_drawn = None
+
+    def setup_static_layer(self):
+        '''the parts of the scene that do not change during a level in one
+           surface. The sling is not in it, its back is drawn over the bird
+           path and its front over the birds'''
+        self.static_layer = pg.Surface(c.SCREEN_SIZE).convert()
+        self.static_layer.fill(c.GRASS_GREEN)
+        self.static_layer.blit(self.background, self.bg_rect)
+        for button in self.buttons:
+            button.draw(self.static_layer)
+        self.static_layer.blit(self.score_label, (1020, c.BUTTON_HEIGHT))
+        self.physics.draw_debug(self.static_layer)
+
     def setup_sling(self):
         rect_list = [(50, 0, 70, 200), (0, 0, 60, 200)]
 
@@ -100,6 +140,9 @@ class Level(tool.State):
         self.sling_click = False
         self.mouse_distance = 0
         self.sling_angle = 0
+        # area of the ropes and the aim preview drawn last, the aim is only
+        # known once the sling is drawn
+        self.aim_rect = None
 
     def setup_birds(self):
         self.birds = []
@@ -132,8 +175,16 @@ class Level(tool.State):
             if tmp:
                 self.physics.add_block(tmp)
 
+    def setup_settled(self):
+        '''start from the resting state written by source.settle'''
+        settled_data = tool.load_settled_data(self.game_info[c.LEVEL_NUM], self.map_data)
+        if settled_data is not None:
+            self.physics.set_settled_state(settled_data)
+
     def update(self, surface, current_time, mouse_pos, mouse_pressed):
         self.game_info[c.CURRENT_TIME] = self.current_time = current_time
+        if self.recorder is not None:
+            self.recorder.record_frame(current_time, mouse_pressed)
         self.handle_states(mouse_pos, mouse_pressed)
         self.check_game_state()
         self.draw(surface)
@@ -169,6 +220,8 @@ class Level(tool.State):
                         self.physics.add_bird(self.active_bird, self.mouse_distance,
                                               self.sling_angle, xo, yo)
                         self.active_bird.set_attack()
+                        if self.recorder is not None:
+                            self.recorder.record_shot(self.mouse_distance, self.sling_angle)
                         try:
                             self.birds.remove(self.active_bird)
                         except ValueError:
@@ -214,6 +267,8 @@ class Level(tool.State):
                 self.physics.add_bird(self.active_bird, self.mouse_distance,
                                       self.sling_angle, xo, yo)
                 self.active_bird.set_attack()
+                if self.recorder is not None:
+                    self.recorder.record_shot(self.mouse_distance, self.sling_angle)
                 try:
                     self.birds.remove(self.active_bird)
                 except ValueError:
@@ -285,12 +340,23 @@ class Level(tool.State):
                 self.mouse_distance = mouse_distance
             else:
                 self.mouse_distance = -mouse_distance
+            self.draw_trajectory(surface)
         else:
             pg.draw.line(surface, (0, 0, 0), (sling_x, sling_y-8), (sling2_x, sling2_y-7), 5)
             # guard: active_bird may be None if removed
             if (self.active_bird is not None) and hasattr(self.active_bird, 'state') and self.active_bird.state == c.IDLE:
                 self.active_bird.draw(surface)
 
+    def draw_trajectory(self, surface):
+        '''aim preview of the active bird if the sling is released now'''
+        xo = 154
+        yo = 444
+        path = physics.get_trajectory(self.mouse_distance, self.sling_angle,
+                                      self.active_bird.mass, xo, yo)
+        for pos in path:
+            pg.draw.circle(surface, c.WHITE, pos, 3, 0)
+        self.aim_rect = SLING_AREA.unionall([pg.Rect(x - 3, y - 3, 7, 7) for x, y in path])
+
     def check_button_click(self, mouse_pos, mouse_pressed):
         if mouse_pressed and mouse_pos:
             for button in self.buttons:
@@ -324,16 +390,38 @@ class Level(tool.State):
             self.game_info[c.SCORE] = self.score
             self.next = c.LEVEL
             self.state = c.OVER
+            self.save_recording()
+            self.save_stats()
         elif self.check_lose():
             self.next = c.LEVEL
             self.state = c.OVER
+            self.save_recording()
+            self.save_stats()
+
+    def save_recording(self):
+        if self.recorder is None:
+            return
+        self.recorder.finish(self.physics, self.birds)
+        if not os.path.exists(c.RECORD_DIR):
+            os.makedirs(c.RECORD_DIR)
+        file_name = 'level_%d_%d.json' % (self.level_num, self.seed)
+        self.recorder.save(os.path.join(c.RECORD_DIR, file_name))
+        self.recorder = None
+
+    def save_stats(self):
+        if self.physics.stats is None:
+            return
+        if not os.path.exists(c.STATS_DIR):
+            os.makedirs(c.STATS_DIR)
+        file_name = 'level_%d_%d.json' % (self.level_num, self.seed)
+        self.physics.stats.save(os.path.join(c.STATS_DIR, file_name))
 
     def swith_bird_path(self):
         self.bird_old_path = self.bird_path.copy()
         self.bird_path = []
 
-    def draw_bird_path(self, surface, path):
-        for i, pos in enumerate(path):
+    def draw_bird_path(self, surface, path, start=0, end=None):
+        for i, pos in enumerate(path[start:end], start):
             if i % 3 == 0:
                 size = 4
             elif i % 3 == 1:
@@ -343,24 +431,71 @@ class Level(tool.State):
             pg.draw.circle(surface, c.WHITE, pos, size, 0)
 
     def draw(self, surface):
-        surface.fill(c.GRASS_GREEN)
-        surface.blit(self.background, self.bg_rect)
-        for button in self.buttons:
-            button.draw(surface)
+        if c.DIRTY_RECTS:
+            self.dirty_rects = self.renderer.draw(surface, self.draw_background,
+                                                  self.get_draw_items())
+        else:
+            self.draw_background(surface)
+            for key, rect, state, draw in self.get_draw_items():
+                draw(surface)
 
-        score_font = bold_font.render("SCORE:", 1, c.WHITE)
-        number_font = bold_font.render(str(self.score), 1, c.WHITE)
-        surface.blit(score_font, (1020, c.BUTTON_HEIGHT))
-        surface.blit(number_font, (1120, c.BUTTON_HEIGHT))
+    def draw_background(self, surface):
+        surface.blit(self.static_layer, (0, 0))
 
-        self.draw_bird_path(surface, self.bird_old_path)
-        self.draw_bird_path(surface, self.bird_path)
+    def draw_score(self, surface):
+        surface.blit(self.score_image, (1120, c.BUTTON_HEIGHT))
 
+    def draw_sling1(self, surface):
         surface.blit(self.sling1_image, self.sling1_rect)
-        self.draw_sling_and_active_bird(surface)
-        for bird in self.birds:
-            bird.draw(surface)
-        
+
+    def draw_sling2(self, surface):
         surface.blit(self.sling2_image, self.sling2_rect)
 
-        self.physics.draw(surface)
\ No newline at end of file
+    def get_draw_items(self):
+        '''the parts of the scene drawn over the background in drawing order,
+           as (key, rect, state, draw) items of tool.DirtyRenderer'''
+        if self.score_drawn != self.score:
+            self.score_image = bold_font.render(str(self.score), 1, c.WHITE)
+            self.score_drawn = self.score
+        items = [('score', self.score_image.get_rect(x=1120, y=c.BUTTON_HEIGHT),
+                  self.score_image, self.draw_score)]
+
+        for name, path in (('old path', self.bird_old_path), ('path', self.bird_path)):
+            for start in range(0, len(path), PATH_CHUNK):
+                chunk = path[start:start + PATH_CHUNK]
+                rect = pg.Rect(chunk[0][0] - 6, chunk[0][1] - 6, 13, 13)
+                rect.unionall_ip([pg.Rect(x - 6, y - 6, 13, 13) for x, y in chunk])
+                draw = (lambda surface, path=path, start=start:
+                        self.draw_bird_path(surface, path, start, start + PATH_CHUNK))
+                items.append(((name, start), rect, tuple(chunk), draw))
+
+        items.append(('sling1', self.sling1_rect, None, self.draw_sling1))
+        items.append(self.get_sling_item())
+        for bird in self.birds:
+            items.append(get_sprite_item(bird))
+        items.append(('sling2', self.sling2_rect, None, self.draw_sling2))
+        for entities in (self.physics.birds, self.physics.pigs,
+                         self.physics.blocks, self.physics.eggs):
+            for entity in entities:
+                items.append(get_sprite_item(entity))
+        return items
+
+    def get_sling_item(self):
+        '''the ropes, the bird in the sling and the aim preview, drawn again
+           on every frame while the sling is pulled. The first frame of a
+           pull draws the whole screen as the aim is not known yet'''
+        if self.sling_click:
+            state = self.current_time
+            if self.aim_rect is None:
+                rect = pg.Rect((0, 0), c.SCREEN_SIZE)
+            else:
+                rect = self.aim_rect
+        else:
+            self.aim_rect = None
+            rect = SLING_AREA
+            if self.active_bird is not None:
+                state = (self.active_bird.image, self.active_bird.rect.topleft,
+                         self.active_bird.state)
+            else:
+                state = None
+        return ('sling', rect, state, self.draw_sling_and_active_bird)
\ No newline at end of file
@@ -2,6 +2,8 @@ __author__ = 'marble_xu'
 
 import os
 import json
+import hashlib
+import functools
 from abc import abstractmethod
 import pygame as pg
 from . import constants as c
@@ -13,6 +15,8 @@ class State():
         self.done = False
         self.next = None
         self.persist = {}
+        # rects of the screen changed by the last update, None for all
+        self.dirty_rects = None
     
     @abstractmethod
     def startup(self, current_time, persist):
@@ -80,12 +84,72 @@ class Control():
         while not self.done:
             self.event_loop()
             self.update()
-            pg.display.update()
+            if self.state.dirty_rects is None:
+                pg.display.update()
+            else:
+                pg.display.update(self.state.dirty_rects)
             self.clock.tick(self.fps)
             if c.DEBUG:
                 pg.display.set_caption("pos: " + str(pg.mouse.get_pos()))
         print('game over')
 
+class DirtyRenderer():
+    '''draws only the parts of the screen that changed since the last frame.
+       The scene is a background and a list of items in drawing order, an
+       item is (key, rect, state, draw): rect is the area the draw function
+       covers and an item is dirty when its rect or state differ from the
+       last frame. The old and new rects of the dirty items are merged, then
+       each merged rect gets the background and all items over it, clipped'''
+    def __init__(self):
+        self.items = None
+
+    def draw(self, surface, draw_background, items):
+        '''return the rects of the surface that changed'''
+        screen_rect = surface.get_rect()
+        dirty = []
+        current = {}
+        for key, rect, state, draw in items:
+            current[key] = (rect, state)
+            if self.items is not None:
+                last = self.items.pop(key, None)
+                if last is None:
+                    dirty.append(rect)
+                elif last != (rect, state):
+                    dirty.append(rect)
+                    dirty.append(last[0])
+        if self.items is None:
+            dirty = [screen_rect]
+        else:
+            # the items that are gone
+            dirty.extend(rect for rect, state in self.items.values())
+        self.items = current
+
+        rects = merge_rects(dirty, screen_rect)
+        if sum(rect.w * rect.h for rect in rects) > screen_rect.w * screen_rect.h * c.DIRTY_MAX_AREA:
+            rects = [screen_rect]
+        for rect in rects:
+            surface.set_clip(rect)
+            draw_background(surface)
+            for key, item_rect, state, draw in items:
+                if item_rect.colliderect(rect):
+                    draw(surface)
+        surface.set_clip(None)
+        return rects
+
+def merge_rects(rects, bounds):
+    '''union of the overlapping rects, clipped to bounds'''
+    merged = []
+    for rect in rects:
+        rect = rect.clip(bounds)
+        if rect.w == 0 or rect.h == 0:
+            continue
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
 def distance(xo, yo, x, y):
     """distance between points"""
     dx = x - xo
@@ -93,6 +157,18 @@ def distance(xo, yo, x, y):
     d = ((dx ** 2) + (dy ** 2)) ** 0.5
     return d
 
+def get_rotated_image(image, angle):
+    '''image rotated by angle degrees rounded to c.ROTATE_ANGLE_STEP, the
+       rotated images are shared by all sprites and must not be changed'''
+    angle = round(angle / c.ROTATE_ANGLE_STEP) * c.ROTATE_ANGLE_STEP % 360
+    if angle == 0:
+        return image
+    return rotate_image(image, angle)
+
+@functools.lru_cache(maxsize=c.ROTATE_CACHE_SIZE)
+def rotate_image(image, angle):
+    return pg.transform.rotate(image, angle)
+
 def get_image(sheet, x, y, width, height, colorkey, scale):
         image = pg.Surface([width, height])
         rect = image.get_rect()
@@ -104,13 +180,17 @@ def get_image(sheet, x, y, width, height, colorkey, scale):
                                     int(rect.height*scale)))
         return image
 
-def load_all_gfx(directory, colorkey=(255,0,255), accept=('.png', '.jpg', '.bmp', '.gif')):
+def load_all_gfx(directory, colorkey=(255,0,255), accept=('.png', '.jpg', '.bmp', '.gif'), convert=True):
     graphics = {}
     for pic in os.listdir(directory):
         name, ext = os.path.splitext(pic)
         if ext.lower() in accept:
             img = pg.image.load(os.path.join(directory, pic))
-            if img.get_alpha():
+            if not convert:
+                # no display mode is set in headless mode, keep the raw pixel format
+                if not img.get_alpha():
+                    img.set_colorkey(colorkey)
+            elif img.get_alpha():
                 img = img.convert_alpha()
             else:
                 img = img.convert()
@@ -118,8 +198,48 @@ def load_all_gfx(directory, colorkey=(255,0,255), accept=('.png', '.jpg', '.bmp'
             graphics[name] = img
     return graphics
 
+def load_map_data(level_num):
+    map_file = 'level_' + str(level_num) + '.json'
+    file_path = os.path.join('source', 'data', 'map', map_file)
+    f = open(file_path)
+    map_data = json.load(f)
+    f.close()
+    return map_data
+
+def get_settled_path(level_num):
+    return os.path.join('source', 'data', 'map', 'level_' + str(level_num) + '.settled.json')
+
+def get_layout_hash(map_data):
+    '''hash of the pigs and blocks of a map, a settled cache is only valid
+       for the layout it was simulated from'''
+    layout = json.dumps([map_data[c.PIGS], map_data[c.BLOCKS]], sort_keys=True)
+    return hashlib.sha1(layout.encode('utf-8')).hexdigest()
+
+def load_settled_data(level_num, map_data):
+    '''resting state of the pigs and blocks written by source.settle, None if
+       there is no cache or the map changed since it was written'''
+    file_path = get_settled_path(level_num)
+    if not os.path.exists(file_path):
+        return None
+    f = open(file_path)
+    settled_data = json.load(f)
+    f.close()
+    if settled_data.get('hash') != get_layout_hash(map_data):
+        return None
+    return settled_data
+
+def setup_display():
+    global SCREEN
+    pg.display.set_caption(c.ORIGINAL_CAPTION)
+    SCREEN = pg.display.set_mode(c.SCREEN_SIZE)
+    GFX.update(load_all_gfx(os.path.join("resources","graphics")))
+
+def setup_headless():
+    '''load the sprite sheets without opening a window, the images are only
+       used to get the size of birds, pigs and blocks'''
+    GFX.update(load_all_gfx(os.path.join("resources","graphics"), convert=False))
+
 pg.init()
-pg.display.set_caption(c.ORIGINAL_CAPTION)
-SCREEN = pg.display.set_mode(c.SCREEN_SIZE)
 
-GFX = load_all_gfx(os.path.join("resources","graphics"))
\ No newline at end of file
+SCREEN = None
+GFX = {}
\ No newline at end of file